@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+"""Measure software debounce of bouncing inputs
+
+Bounces all four inputs at once, as switches do when pressed, and
+reports:
+
+    edges/s     - raw edges taken by the GPIO callbacks per second
+    per edge    - time spent in the callback for each edge
+    transitions - settled changes of level reported to handlers
+    memory      - memory held once every edge has settled, after a
+                  few presses and after many, which should not grow
+
+Usage: python benchmarks/debounce.py [presses]
+
+Exits with status 1 if a press was missed, reported twice or memory
+grew with the number of edges. Runs against the simulated board unless
+EXPLORERHAT_BACKEND is set."""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import explorerhat
+from explorerhat.pins import monotonic_ns
+
+
+PRESSES = 2000
+
+# Enough to fill each input's edge buffer before memory is measured
+WARMUP = 50
+
+# Edges in each press, the last one at the new level
+BOUNCES = 9
+
+SETTLE_MS = 2
+
+
+def bounce(sim, pins, level):
+    """Bounce every pin in pins, ending at level"""
+    for n in range(BOUNCES):
+        value = level if n % 2 == 0 else 1 - level
+        for pin in pins:
+            sim.gpio_device.set_input(pin, value)
+
+
+def press(sim, pins, presses):
+    """Press and release presses times, returning the time spent in callbacks"""
+    elapsed = 0
+    level = 0
+
+    for _ in range(presses):
+        level = 1 - level
+        start = monotonic_ns()
+        bounce(sim, pins, level)
+        elapsed += monotonic_ns() - start
+
+        # Long enough for the press to settle
+        time.sleep(SETTLE_MS * 2 / 1000.0)
+
+    return elapsed
+
+
+def held():
+    try:
+        import tracemalloc
+    except ImportError:
+        return None
+    return tracemalloc.get_traced_memory()[0]
+
+
+def main():
+    presses = int(sys.argv[1]) if len(sys.argv) > 1 else PRESSES
+
+    explorerhat.set_backend(os.environ.get('EXPLORERHAT_BACKEND', 'sim'))
+    sim = explorerhat.backend.get_backend()
+
+    inputs = list(explorerhat.input)
+    pins = [obj.pin for obj in inputs]
+    settled = dict((obj.name, 0) for obj in inputs)
+
+    def changed(obj):
+        settled[obj.name] += 1
+
+    for obj in inputs:
+        obj.on_changed(changed)
+        obj.debounce(SETTLE_MS)
+
+    try:
+        import tracemalloc
+        tracemalloc.start()
+    except ImportError:
+        print("tracemalloc is unavailable, memory won't be measured")
+
+    # Warm up first, so everything used along the way already exists
+    press(sim, pins, WARMUP)
+    before = held()
+
+    elapsed = press(sim, pins, presses)
+    after = held()
+
+    edges = presses * BOUNCES * len(pins)
+    print("{:>12}: {:.0f}".format("edges/s", edges * 1000000000.0 / elapsed))
+    print("{:>12}: {:.1f}us".format("per edge", elapsed / 1000.0 / edges))
+
+    failed = False
+    for obj in inputs:
+        stats = obj.get_debounce_stats()
+        print("{:>12}: {} transitions, {} glitches from {} edges".format(
+            obj.name, stats['transitions'], stats['glitches'], stats['edges']))
+        if settled[obj.name] != presses + WARMUP:
+            failed = True
+
+    if before is not None:
+        grown = after - before
+        print("{:>12}: {} bytes grown over {} edges".format("memory", grown, edges))
+        # Allow for allocator noise, but not for anything kept per edge
+        if grown > 4096:
+            failed = True
+
+    for obj in inputs:
+        obj.clear_events()
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+"""Measure how quickly fades can be started, and how soon they take effect
+
+Starts fades back to back across every output and light, as a UI
+fading lights in response to touches would, and reports:
+
+    fades/s     - fade() calls per second
+    latency     - time from calling fade() to its first brightness change
+    threads     - most threads alive at once during the run
+
+For comparison the same is measured for starting a new thread per
+fade, which is how fades used to be run.
+
+Usage: python benchmarks/fade_rate.py [fades]
+
+Runs against the simulated board unless EXPLORERHAT_BACKEND is set."""
+
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import explorerhat
+from explorerhat.pins import monotonic_ns
+
+
+FADES = 2000
+
+# An unusual starting brightness, to pick the fade's first change out from others
+START = 37
+
+
+class FirstChange(object):
+    """Wraps an output's duty_cycle() to time its first change to START"""
+    def __init__(self, obj):
+        self.duty_cycle = obj.duty_cycle
+        self.changed = threading.Event()
+        self.time = None
+        obj.duty_cycle = self
+
+    def __call__(self, duty_cycle):
+        if duty_cycle == START and self.time is None:
+            self.time = monotonic_ns()
+            self.changed.set()
+        return self.duty_cycle(duty_cycle)
+
+    def reset(self):
+        self.time = None
+        self.changed.clear()
+
+
+def fade(obj):
+    obj.fade(START, 100, 0.5)
+
+
+def thread_per_fade(obj):
+    worker = threading.Thread(target=obj.duty_cycle, args=(START,))
+    worker.daemon = True
+    worker.start()
+
+
+def measure(start_fade, members, fades):
+    latencies = []
+    threads = threading.active_count()
+
+    start = monotonic_ns()
+    for n in range(fades):
+        obj, first = members[n % len(members)]
+        first.reset()
+
+        called = monotonic_ns()
+        start_fade(obj)
+        first.changed.wait(1.0)
+
+        if first.time is not None:
+            latencies.append(first.time - called)
+        threads = max(threads, threading.active_count())
+
+    elapsed = monotonic_ns() - start
+
+    latencies.sort()
+    return (fades * 1000000000.0 / elapsed,
+            latencies[len(latencies) // 2] / 1000.0,
+            latencies[int(len(latencies) * 0.99)] / 1000.0,
+            threads)
+
+
+def main():
+    fades = int(sys.argv[1]) if len(sys.argv) > 1 else FADES
+
+    explorerhat.set_backend(os.environ.get('EXPLORERHAT_BACKEND', 'sim'))
+
+    members = [(obj, FirstChange(obj)) for collection in (explorerhat.output, explorerhat.light) for obj in collection]
+
+    for label, start_fade in (('scheduler', fade), ('thread per fade', thread_per_fade)):
+        rate, median, p99, threads = measure(start_fade, members, fades)
+        print("{:>15}: {:8.0f} fades/s, latency median {:.1f}us, 99th percentile {:.1f}us, {} threads".format(
+            label, rate, median, p99, threads))
+
+    for obj, first in members:
+        obj.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+
+"""Measure the cost of measuring an input's frequency
+
+Reports, for each way of counting a signal on an input:
+
+    per edge    - time spent in the GPIO callback for each edge, counting
+                  with an on_changed() handler and with start_frequency()
+    per gate    - time to measure a one second gate of a 5kHz signal,
+                  and the frequency and duty cycle it found
+
+Usage: python benchmarks/frequency.py [edges]
+
+Runs against the simulated board unless EXPLORERHAT_BACKEND is set."""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import explorerhat
+from explorerhat import frequency
+from explorerhat.edges import EdgeBuffer
+from explorerhat.pins import monotonic_ns
+
+
+EDGES = 20000
+
+# 5kHz with a 30% duty cycle, in nanoseconds
+PERIOD = 200000
+PULSE_WIDTH = 60000
+
+
+def toggle(sim, pin, edges):
+    """Toggle pin edges times, returning the time taken per edge in microseconds"""
+    start = monotonic_ns()
+    for n in range(edges):
+        sim.gpio_device.set_input(pin, n % 2 == 0)
+    return (monotonic_ns() - start) / 1000.0 / edges
+
+
+def gate():
+    """Measure one second of signal, returning (microseconds taken, result)"""
+    cycles = frequency.NANOSECONDS // PERIOD
+    buffer = EdgeBuffer(cycles * 2)
+
+    for n in range(cycles):
+        buffer.push(n * PERIOD, 1)
+        buffer.push(n * PERIOD + PULSE_WIDTH, 0)
+
+    counter = frequency.FrequencyCounter(buffer, 1.0, 0)
+
+    start = monotonic_ns()
+    result = counter.update(frequency.NANOSECONDS)
+    return (monotonic_ns() - start) / 1000.0, result
+
+
+def main():
+    edges = int(sys.argv[1]) if len(sys.argv) > 1 else EDGES
+
+    explorerhat.set_backend(os.environ.get('EXPLORERHAT_BACKEND', 'sim'))
+    sim = explorerhat.backend.get_backend()
+
+    counted = [0]
+
+    def changed(obj):
+        counted[0] += 1
+
+    handler = explorerhat.input.one
+    handler.on_changed(changed, 0)
+    print("{:>15}: {:.2f}us per edge".format("on_changed", toggle(sim, handler.pin, edges)))
+
+    measured = explorerhat.input.two
+    measured.start_frequency(size=edges)
+    print("{:>15}: {:.2f}us per edge".format("start_frequency", toggle(sim, measured.pin, edges)))
+
+    handler.clear_events()
+    measured.clear_events()
+
+    elapsed, result = gate()
+    print("{:>15}: {:.0f}us per gate of {} edges, {:.1f}Hz at {:.1f}% duty".format(
+        "measurement", elapsed, result['edges'], result['frequency'], result['duty_cycle']))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+"""Count the I2C transactions behind common operations
+
+Batches hold the bus but don't merge transfers, and shadowed registers
+aren't written again with the same value, so each operation below
+should cost exactly the transactions listed:
+
+    multitouch      - CAP1208 read-modify-write, the same again, then back
+    comparator      - both ADS1015 thresholds and the config, then the same again
+    continuous      - one read per reading while converting continuously
+
+Usage: python benchmarks/i2c_transactions.py
+
+Exits with status 1 if any operation costs more or fewer. Runs against
+the simulated board unless EXPLORERHAT_BACKEND is set."""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import explorerhat
+from explorerhat import ads1015
+
+
+READS = 100
+
+
+def transactions(operation):
+    explorerhat.reset_i2c_stats()
+    operation()
+    return explorerhat.get_i2c_stats()['transactions']
+
+
+def main():
+    explorerhat.set_backend(os.environ.get('EXPLORERHAT_BACKEND', 'sim'))
+
+    if not explorerhat.setup_captouch() or not explorerhat.setup_analog():
+        print("Touch or analog is unavailable")
+        sys.exit(1)
+
+    adc = ads1015.adc
+    settings = explorerhat.CapTouchSettings
+
+    def read_continuous():
+        for _ in range(READS):
+            adc.read_raw(1, ads1015.PGA_6_144V, 3300)
+
+    checks = [
+        ("multitouch", lambda: settings.enable_multitouch(True), 2),
+        ("again", lambda: settings.enable_multitouch(True), 0),
+        ("back", lambda: settings.enable_multitouch(False), 1),
+        ("comparator", lambda: adc.start_comparator(0, 1.0, 3.0), 3),
+        ("again", lambda: adc.start_comparator(0, 1.0, 3.0), 0),
+        ("stop", adc.stop_comparator, 1),
+        ("continuous", lambda: adc.start_continuous(1, ads1015.PGA_6_144V, 3300), 1),
+        ("reads", read_continuous, READS),
+        ("stop", adc.stop_continuous, 1),
+    ]
+
+    failed = False
+    for name, operation, expected in checks:
+        count = transactions(operation)
+        print("{:>12}: {} transactions, expected {}".format(name, count, expected))
+        if count != expected:
+            failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
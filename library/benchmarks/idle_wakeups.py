@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+
+"""Check that background threads sleep while there's nothing to do
+
+Starts a pulse, a fade, an analog threshold and a background task,
+then pauses, finishes or clears each of them, and counts how many
+times any background thread wakes over an idle window.
+
+Usage: python benchmarks/idle_wakeups.py [seconds]
+
+Exits with status 1 if any thread woke while idle. Runs against the
+simulated board unless EXPLORERHAT_BACKEND is set."""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import explorerhat
+
+
+SECONDS = 2.0
+
+
+def task():
+    return True
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else SECONDS
+
+    explorerhat.set_backend(os.environ.get('EXPLORERHAT_BACKEND', 'sim'))
+
+    explorerhat.light.red.pulse(0.1, 0.1)
+    explorerhat.light.blue.fade(0, 100, 0.1)
+    explorerhat.async_start('task', task, 0.01)
+
+    analog = explorerhat.is_explorer_pro() or explorerhat.is_explorer_phat()
+    if analog:
+        explorerhat.analog.one.threshold(lambda *args: None, 1.0, 4.0)
+
+    time.sleep(0.5)
+
+    explorerhat.light.red.stop()
+    explorerhat.async_pause('task')
+
+    if analog:
+        explorerhat.analog.one.clear_threshold()
+
+    # Let anything finishing up settle before counting
+    time.sleep(0.1)
+
+    before = explorerhat.get_wakeup_stats()
+    time.sleep(seconds)
+    after = explorerhat.get_wakeup_stats()
+
+    woken = 0
+    for name in sorted(after):
+        wakeups = after[name] - before.get(name, 0)
+        woken += wakeups
+        print("{:>24}: {} wakeups in {:.1f}s idle".format(name, wakeups, seconds))
+
+    explorerhat.async_stop('task')
+    sys.exit(1 if woken else 0)
+
+
+if __name__ == '__main__':
+    main()
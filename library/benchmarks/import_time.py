@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+"""Check that "import explorerhat" stays within its time budget
+
+Imports the library in a fresh interpreter several times and compares
+the median against the budget, exiting with an error if it is exceeded
+or if importing touched any hardware.
+
+Usage: python benchmarks/import_time.py [budget_ms] [runs]
+
+The default budget suits a desktop machine, pass a larger one on a Pi.
+Bytecode caching must be enabled for representative results."""
+
+import os
+import subprocess
+import sys
+
+
+BUDGET_MS = 25.0
+RUNS = 11
+
+PROBE = """
+import sys, time
+t_start = time.time()
+import explorerhat
+elapsed = (time.time() - t_start) * 1000.0
+hardware = [name for name in ('RPi', 'smbus', 'cap1xxx', 'numpy') if name in sys.modules]
+touched = explorerhat._gpio_is_setup or explorerhat._analog_is_setup or explorerhat._captouch_is_setup
+print('{} {} {}'.format(elapsed, ','.join(hardware) or '-', touched))
+"""
+
+
+def measure():
+    library = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+    env = dict(os.environ)
+    env['PYTHONPATH'] = library + os.pathsep + env.get('PYTHONPATH', '')
+    output = subprocess.check_output([sys.executable, '-W', 'ignore', '-c', PROBE], env=env)
+    elapsed, hardware, touched = output.decode('utf-8').split()
+    return float(elapsed), hardware, touched == 'True'
+
+
+def main():
+    budget = float(sys.argv[1]) if len(sys.argv) > 1 else BUDGET_MS
+    runs = int(sys.argv[2]) if len(sys.argv) > 2 else RUNS
+
+    # The first run may need to compile bytecode
+    measure()
+
+    results = [measure() for _ in range(runs)]
+    times = sorted(result[0] for result in results)
+    median = times[len(times) // 2]
+
+    print("import explorerhat: median {:.2f}ms, min {:.2f}ms, max {:.2f}ms over {} runs (budget {:.2f}ms)".format(
+        median, times[0], times[-1], runs, budget))
+
+    failed = False
+
+    for elapsed, hardware, touched in results:
+        if hardware != '-':
+            print("FAIL: importing loaded hardware modules: {}".format(hardware))
+            failed = True
+            break
+        if touched:
+            print("FAIL: importing set up hardware")
+            failed = True
+            break
+
+    if median > budget:
+        print("FAIL: median import time is over budget")
+        failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
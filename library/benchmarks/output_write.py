@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+
+"""Measure how long it takes to switch a whole collection of outputs
+
+Compares a collection write, which applies one set mask and one clear
+mask, against writing each member in turn.
+
+Usage: python benchmarks/output_write.py [writes]
+
+Runs against the simulated board unless EXPLORERHAT_BACKEND is set,
+use EXPLORERHAT_BACKEND=rpi on a Pi to measure the real thing."""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import explorerhat
+from explorerhat.pins import clock
+
+
+WRITES = 2000
+
+
+def per_member(collection, value):
+    for obj in collection:
+        obj.write(value)
+
+
+def measure(write, collection, writes):
+    times = []
+    for n in range(writes):
+        start = clock()
+        write(collection, n & 1)
+        times.append(clock() - start)
+    times.sort()
+    return times[len(times) // 2], times[int(len(times) * 0.99)]
+
+
+def main():
+    writes = int(sys.argv[1]) if len(sys.argv) > 1 else WRITES
+
+    explorerhat.set_backend(os.environ.get('EXPLORERHAT_BACKEND', 'sim'))
+
+    for name in ('output', 'light'):
+        collection = getattr(explorerhat, name)
+
+        # Create and set up every member before timing
+        collection.off()
+
+        for label, write in (('collection', lambda c, v: c.write(v)), ('per member', per_member)):
+            median, p99 = measure(write, collection, writes)
+            print("{}.write() {:>10}: median {:.1f}us, 99th percentile {:.1f}us over {} writes".format(
+                name, label, median * 1000000, p99 * 1000000, writes))
+
+        collection.off()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+"""Measure the CPU used to keep outputs, lights and motors running
+
+Sets every output, light and motor up, then measures the CPU time
+this process uses over a few seconds in each scenario:
+
+    idle    - everything off
+    dimmed  - lights and outputs at 50% brightness
+    blink   - lights and outputs blinking twice a second
+    motors  - both motors at half speed
+
+Usage: python benchmarks/pwm_cpu.py [seconds]
+
+Runs against the simulated board unless EXPLORERHAT_BACKEND is set.
+Use EXPLORERHAT_BACKEND=rpi on a Pi, and run it against an older
+release too, for a before and after comparison."""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import explorerhat
+
+
+SECONDS = 3.0
+
+
+def idle():
+    explorerhat.output.off()
+    explorerhat.light.off()
+    explorerhat.motor.stop()
+
+
+def dimmed():
+    explorerhat.output.brightness(50)
+    explorerhat.light.brightness(50)
+
+
+def blink():
+    explorerhat.output.blink(0.25)
+    explorerhat.light.blink(0.25)
+
+
+def motors():
+    explorerhat.motor.speed(50)
+
+
+def cpu_time():
+    times = os.times()
+    return times[0] + times[1]
+
+
+def measure(seconds):
+    get_stats = getattr(explorerhat, 'get_pwm_stats', None)
+    wakeups = get_stats()['wakeups'] if get_stats else 0
+
+    start_cpu = cpu_time()
+    start = time.time()
+    time.sleep(seconds)
+    elapsed = time.time() - start
+    used = cpu_time() - start_cpu
+
+    if get_stats:
+        wakeups = (get_stats()['wakeups'] - wakeups) / elapsed
+    else:
+        wakeups = None
+
+    return 100.0 * used / elapsed, wakeups
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else SECONDS
+
+    explorerhat.set_backend(os.environ.get('EXPLORERHAT_BACKEND', 'sim'))
+
+    for scenario in (idle, dimmed, blink, motors):
+        idle()
+        scenario()
+        cpu, wakeups = measure(seconds)
+
+        line = "{:>7}: {:5.1f}% CPU".format(scenario.__name__, cpu)
+        if wakeups is not None:
+            line += ", {:.0f} soft PWM wakeups/s".format(wakeups)
+        print(line)
+
+    idle()
+
+    if hasattr(explorerhat, 'get_pwm_stats'):
+        print("Hardware PWM on GPIO: {}".format(explorerhat.get_pwm_stats()['hardware'] or 'none'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+
+"""Check comparator-driven thresholds against polled ones
+
+Steps two analog inputs through the same voltages, one watched by
+the ADS1015 window comparator via ALERT/RDY and one polled by the
+acquisition engine, including steps that cross the whole window at
+once. Reports:
+
+    events      - what each way of watching reported, which must match
+    latency     - time from each step to the comparator's event
+    paused      - events reported while single-shot reads of a third
+                  input pause the comparator, which should be none
+
+Usage: python benchmarks/thresholds.py
+
+Exits with status 1 if the two disagree. Always runs against the
+simulated board, as it needs to set the voltages."""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import explorerhat
+from explorerhat.pins import monotonic_ns
+
+
+ALERT_PIN = 18
+
+LOW = 1.0
+HIGH = 3.0
+
+# Starting below, then across the window in one step in both directions
+STEPS = [0.0, 4.0, 2.0, 0.5, 4.5, 0.2, 2.5, 3.5, 2.9, 0.9]
+
+# Long enough for the polled input to be sampled
+SETTLE = 0.05
+
+# Single-shot reads of another input, each pausing the comparator
+READS = 200
+
+
+def main():
+    explorerhat.ADC_ALERT = ALERT_PIN
+    explorerhat.set_backend(explorerhat.backend.SimulatedBackend(alert_pin=ALERT_PIN))
+    sim = explorerhat.backend.get_backend()
+
+    compared = explorerhat.analog.one
+    polled = explorerhat.analog.two
+    other = explorerhat.analog.three
+    events = {compared.name: [], polled.name: []}
+    latency = []
+    stepped = [0]
+
+    def handler(obj, event, value):
+        if obj is compared and stepped[0]:
+            latency.append(monotonic_ns() - stepped[0])
+        events[obj.name].append(event)
+
+    sim.ads1015.set_voltage(compared.channel, STEPS[0])
+    sim.ads1015.set_voltage(polled.channel, STEPS[0])
+
+    compared.threshold(handler, LOW, HIGH)
+    polled.threshold(handler, LOW, HIGH)
+    time.sleep(SETTLE)
+
+    for step in STEPS[1:]:
+        stepped[0] = monotonic_ns()
+        sim.ads1015.set_voltage(compared.channel, step)
+        sim.ads1015.set_voltage(polled.channel, step)
+        time.sleep(SETTLE)
+
+    # Inside the window, unlike the compared input
+    sim.ads1015.set_voltage(other.channel, (LOW + HIGH) / 2)
+    reported = len(events[compared.name])
+    for _ in range(READS):
+        other.read()
+    paused = len(events[compared.name]) - reported
+
+    compared.clear_threshold()
+    polled.clear_threshold()
+
+    for name in (compared.name, polled.name):
+        print("{:>8}: {}".format(name, ', '.join(events[name])))
+
+    if latency:
+        print("{:>8}: {:.0f}us mean, {:.0f}us max".format(
+            "latency", sum(latency) / 1000.0 / len(latency), max(latency) / 1000.0))
+
+    print("{:>8}: {} events from {} reads".format("paused", paused, READS))
+
+    sys.exit(0 if events[compared.name] == events[polled.name] and not paused else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,29 +3,21 @@
 API library for Explorer HAT and Explorer HAT Pro, Raspberry Pi add-on boards"""
 
 import atexit
-import signal
 import time
-from sys import version_info
-
-try:
-    from smbus import SMBus
-except ImportError:
-    if version_info[0] < 3:
-        raise ImportError("This library requires python-smbus\nInstall with: sudo apt-get install python-smbus")
-    elif version_info[0] == 3:
-        raise ImportError("This library requires python3-smbus\nInstall with: sudo apt-get install python3-smbus")
-
-try:
-    import RPi.GPIO as GPIO
-except ImportError:
-    raise ImportError("This library requires the RPi.GPIO module\nInstall with: sudo pip install RPi.GPIO")
-
-try:
-    from cap1xxx import Cap1208
-except ImportError:
-    raise ImportError("This library requires the cap1xxx module\nInstall with: sudo pip install cap1xxx")
-
-from .pins import ObjectCollection, AsyncWorker, StoppableThread
+from array import array
+
+from . import ads1015, backend
+from .i2c import I2CBus, RegisterShadow
+from .backend import get_backend, IN, OUT, LOW, PUD_UP
+from .acquisition import get_engine, stop_engine
+from . import dispatch, waveform
+from .debounce import NANOSECONDS_PER_MS, PinDebouncer, get_debounce_engine, stop_debounce_engine
+from .animation import Animation, frame_at, frame_deadline, get_scheduler, set_frame_batch, stop_scheduler
+from .pwm import get_pwm_engine, stop_pwm_engine
+from .timeline import Timeline
+from .edges import EDGE_BUFFER_SIZE, EdgeBuffer, EdgeStats
+from .frequency import FrequencyCounter
+from .pins import ObjectCollection, AsyncWorker, StoppableThread, clock, get_wakeups, monotonic_ns
 
 
 __version__ = '0.4.2'
@@ -34,6 +26,9 @@ _verbose = False
 _gpio_is_setup = False
 _analog_is_setup = False
 _captouch_is_setup = False
+_i2c = None
+_gpiomem_is_setup = False
+_gpiomem = None
 
 explorer_pro = False
 explorer_phat = False
@@ -66,6 +61,11 @@ M1F = 20
 M2B = 21
 M2F = 26
 
+# ADS1015 ALERT/RDY, not connected on Explorer HAT/pHAT
+# Set to the GPIO it is wired to for comparator-driven thresholds,
+# the GPIO's internal pull-up is enabled as ALERT/RDY is open drain
+ADC_ALERT = None
+
 # Number of times to update
 # pulsing LEDs per second
 PULSE_FPS = 50
@@ -73,8 +73,21 @@ PULSE_FREQUENCY = 1000
 
 DEBOUNCE_TIME = 20
 
+# Seconds each frequency measurement covers, and
+# most edges held between measurements
+FREQUENCY_GATE = 1.0
+FREQUENCY_BUFFER_SIZE = 4096
+
 CAP_PRODUCT_ID = 107
 
+# CAP1208 multiple touch config register and its blocking enable bit
+CAP_MTOUCH_CONFIG = 0x2A
+CAP_MTOUCH_BLOCK = 0x80
+
+# RPi.GPIO compatible module supplied by
+# the active backend, see setup_gpio()
+GPIO = None
+
 
 def help(topic=None):
     return _help[topic]
@@ -83,14 +96,39 @@ def set_verbose(value):
     global _verbose
     _verbose = value
 
+def set_backend(name):
+    """Select the hardware backend
+
+    @param name "rpi", "sim" or a backend.Backend instance
+
+    Must be called before any Explorer HAT hardware is used."""
+    if _gpio_is_setup or _analog_is_setup or _captouch_is_setup:
+        raise RuntimeError("The backend must be selected before Explorer HAT hardware is used")
+    return backend.set_backend(name)
+
 def explorerhat_exit():
     if _verbose: print("\nExplorer HAT exiting cleanly, please wait...")
 
     if _verbose: print("Stopping flashy things...")
-    output.stop()
-    input.stop()
-    light.stop()
-    light.stop_pulse()
+    # Only stop what has been used, rather than creating everything
+    for obj in output._instances():
+        obj.stop()
+    for obj in input._instances():
+        obj.stop()
+    for obj in light._instances():
+        obj.stop()
+        obj.stop_pulse()
+    for obj in motor._instances():
+        obj.stop()
+    stop_scheduler()
+    stop_pwm_engine()
+
+    if _verbose: print("Stopping analog sampling...")
+    stop_engine()
+
+    if _verbose: print("Stopping event handlers...")
+    stop_debounce_engine()
+    dispatch.stop_dispatcher()
 
     if _verbose: print("Stopping user tasks...")
     async_stop_all()
@@ -105,23 +143,113 @@ def setup():
     setup_captouch()
     setup_analog()
 
-def setup_gpio(pin=None, mode=None, initial=0):
-    global _gpio_is_setup
+def setup_gpio(pin=None, mode=None, initial=0, pull_up_down=None):
+    global _gpio_is_setup, GPIO
 
     if not _gpio_is_setup:
         _gpio_is_setup = True
+        GPIO = get_backend().gpio()
         GPIO.setmode(GPIO.BCM)
         GPIO.setwarnings(False)
         atexit.register(explorerhat_exit)
 
     if pin is not None and mode is not None:
-        if mode == GPIO.OUT:
+        if mode == OUT:
             GPIO.setup(pin, mode, initial=initial)
+        elif pull_up_down is not None:
+            GPIO.setup(pin, mode, pull_up_down=pull_up_down)
         else:
             GPIO.setup(pin, mode)
 
+def setup_i2c():
+    """Returns the I2C bus shared by the analog and touch drivers"""
+    global _i2c
+
+    if _i2c is None:
+        _i2c = I2CBus(get_backend().i2c_bus())
+
+    return _i2c
+
+def setup_gpiomem():
+    """Returns the memory-mapped GPIO registers, or None if they can't be mapped"""
+    global _gpiomem_is_setup, _gpiomem
+
+    if not _gpiomem_is_setup:
+        _gpiomem_is_setup = True
+        _gpiomem = get_backend().gpio_mem()
+
+    return _gpiomem
+
+def setup_pwm(pin, frequency):
+    """Returns an RPi.GPIO.PWM compatible channel for pin
+
+    Uses hardware PWM if the pin is routed to it, otherwise
+    the pin joins the shared software PWM thread."""
+    setup_gpio()
+    channel = get_pwm_engine(get_backend()).channel(pin, frequency)
+
+    # Hardware PWM pins must keep their alternate function
+    if not channel.hardware:
+        setup_gpio(pin, OUT)
+
+    return channel
+
+def get_pwm_stats():
+    """Returns the pins using hardware PWM, how busy the software PWM thread is,
+    and how many duty cycle and frequency changes were applied or skipped as redundant"""
+    return get_pwm_engine(get_backend()).get_stats()
+
+def reset_pwm_stats():
+    get_pwm_engine(get_backend()).reset_stats()
+
+def _pwm_frame_batch():
+    return get_pwm_engine(get_backend()).batch()
+
+def _write_outputs(set_mask, clear_mask):
+    """Drives every GPIO in set_mask high and every GPIO in clear_mask low, together"""
+    get_backend().write_outputs(set_mask, clear_mask)
+
+def get_wakeup_stats():
+    """Returns how many times each background thread has woken up, by thread name
+
+    Every background thread blocks while it has nothing to do, so
+    these stay still while nothing is animated, blinking, watched
+    or running as a task."""
+    return get_wakeups()
+
+def set_dispatch(mode, workers=dispatch.MAX_WORKERS, max_queue=dispatch.MAX_QUEUE):
+    """Chooses how input, touch and analog handlers are run
+
+    Events from each input, pad or analog channel are always handled
+    one at a time, in order, whichever mode is chosen.
+
+    @param mode "inline" to run handlers on the thread that saw the event, the default,
+                "thread" to run them on a pool of threads, or "process" on a pool of processes
+    @param workers Most threads or processes to run handlers on
+    @param max_queue Most events to hold for each input, pad or channel, beyond which they are dropped"""
+    dispatch.set_dispatcher(mode, workers, max_queue)
+    return True
+
+def get_dispatch_stats():
+    """Returns, for each handler by name, how many times it was called or dropped,
+    how many calls are queued, and the mean and maximum delay before a call in microseconds"""
+    return dispatch.get_dispatcher().get_stats()
+
+def reset_dispatch_stats():
+    dispatch.get_dispatcher().reset_stats()
+
+def _dispatch(source, handler, *args):
+    dispatch.get_dispatcher().dispatch(source, handler, *args)
+
+def get_i2c_stats():
+    """Returns I2C transaction, byte and lock contention counters"""
+    return setup_i2c().get_stats()
+
+def reset_i2c_stats():
+    setup_i2c().reset_stats()
+
 def setup_captouch():
-    global _captouch_is_setup, has_captouch, _cap1208
+    global _captouch_is_setup, has_captouch, _cap1208, _cap_shadow
 
     if _captouch_is_setup:
         return has_captouch
@@ -129,7 +257,8 @@ def setup_captouch():
     _captouch_is_setup = True
 
     try:
-        _cap1208 = Cap1208()
+        _cap1208 = get_backend().cap1208(setup_i2c())
+        _cap_shadow = RegisterShadow(setup_i2c(), _cap1208.i2c_addr)
         has_captouch = True
     except IOError:
         has_captouch = False
@@ -144,13 +273,14 @@ def setup_analog():
 
     _analog_is_setup = True
 
-    from .ads1015 import read_se_adc, adc_available 
-
-    if adc_available:
-        has_analog = True
-    else:
+    try:
+        has_analog = ads1015.setup(setup_i2c())
+    except IOError:
         has_analog = False
 
+    read_se_adc = ads1015.read_se_adc
+    adc_available = has_analog
+
     return has_analog
 
 def is_explorer_pro():
@@ -169,68 +299,104 @@ def is_explorer_phat():
     return has_analog and not has_captouch
 
 
-class Pulse(StoppableThread):
-    """Basic thread wrapper class for delta-timed LED pulsing
+class Pulse(Animation):
+    """Delta-timed LED pulsing, run by the shared animation scheduler
 
-    Pulses an LED in perfect wall-clock time
-    Small delay by 1.0/FPS to prevent unnecessary workload"""
-    def __init__(self, pin, time_on, time_off, transition_on, transition_off):
-        StoppableThread.__init__(self)
+    Pulses an LED in perfect clock time, looking each frame up
+    in a precomputed waveform. Runs at up to PULSE_FPS, sleeping
+    through frames where the brightness doesn't change, with each
+    frame due a whole number of frames from the start."""
+    def __init__(self, pin, time_on, time_off, transition_on, transition_off, shape='linear'):
+        Animation.__init__(self)
 
-        self._paused = False
         self.pin = pin
         self.time_on = time_on
         self.time_off = time_off
         self.transition_on = transition_on
         self.transition_off = transition_off
+        self.shape = shape
 
         self.fps = PULSE_FPS
+        self.waveform = None
+        self._duty = None
 
         # Total time of transition
-        self.time_start = time.time()
+        self.time_start = monotonic_ns()
 
     def start(self):
+        self.waveform = waveform.pulse(self.transition_on, self.time_on, self.transition_off, self.time_off,
+                                       self.fps, self.shape)
+        self._duty = None
         self.pin.frequency(PULSE_FREQUENCY)
+        self.stats.reset()
+        self.time_start = monotonic_ns()
+        Animation.start(self)
 
-        if self._paused:
-            self.time_start = time.time()
-            self._paused = False
-            return
+    def pause(self):
+        Animation.stop(self)
 
-        self.time_start = time.time()
-        StoppableThread.start(self)
+    def stop(self):
+        Animation.stop(self)
+        self.pin.duty_cycle(0)
 
-    def pause(self):
-        self._paused = True
+    def step(self, now):
+        table = self.waveform
+        cycles, frame = divmod(frame_at(self.time_start, now, table.fps), len(table))
 
-    def run(self):
-        # This loop runs at the specified "FPS" uses time.time()
-        while not self.stop_event.is_set():
-            if not self._paused:
-                current_time = time.time() - self.time_start
-                delta = current_time % (self.transition_on+self.time_on+self.transition_off+self.time_off)
+        duty = table.duties[frame]
+        if duty != self._duty:
+            self._duty = duty
+            self.pin.duty_cycle(duty)
 
-                time_off = self.transition_on + self.time_on + self.transition_off
-                time_on = self.transition_on + self.time_on
+        # Sleep until the brightness next changes
+        return frame_deadline(self.time_start, cycles * len(table) + table.next_change[frame], table.fps)
 
-                if delta <= self.transition_on:
-                    # Transition On Phase
-                    self.pin.duty_cycle(round((100.0 / self.transition_on) * delta))
 
-                elif time_on < delta <= time_off:
-                    # Transition Off Phase
-                    current_delta = delta - self.transition_on - self.time_on
-                    self.pin.duty_cycle(round(100.0 - ((100.0 / self.transition_off) * current_delta)))
+class Fade(Animation):
+    """Fade between two brightnesses, run by the shared animation scheduler
 
-                elif delta > self.transition_on < delta <= time_on:
-                    self.pin.duty_cycle(100)
+    Each output keeps one Fade, which is set up afresh for every fade."""
+    def __init__(self, pin, start, end, duration, shape='linear'):
+        Animation.__init__(self)
 
-                elif delta > time_off:
-                    self.pin.duty_cycle(0)
+        self.pin = pin
+        self.fps = PULSE_FPS
+        self.setup(start, end, duration, shape)
 
-            time.sleep(1.0/self.fps)
+    def setup(self, start, end, duration, shape='linear'):
+        self.start_value = start
+        self.end_value = end
+        self.duration = duration
+        self.waveform = waveform.fade(start, end, duration, self.fps, shape)
+        self._duty = None
+        self.time_start = monotonic_ns()
 
-        self.pin.duty_cycle(0)
+    def start(self):
+        """Start fading, with the pin already at the start brightness
+
+        The first frame is the start brightness, so the scheduler
+        isn't woken for it, only from the first change on."""
+        table = self.waveform
+        self._duty = table.duties[0]
+        self.stats.reset()
+        self.time_start = monotonic_ns()
+        get_scheduler().add(self, frame_deadline(self.time_start, min(table.next_change[0], len(table) - 1), table.fps))
+
+    def step(self, now):
+        table = self.waveform
+        frame = frame_at(self.time_start, now, table.fps)
+
+        if frame >= len(table) - 1:
+            self.pin.duty_cycle(self.end_value)
+            self.pin.fading = False
+            return None
+
+        duty = table.duties[frame]
+        if duty != self._duty:
+            self._duty = duty
+            self.pin.duty_cycle(duty)
+
+        return frame_deadline(self.time_start, table.next_change[frame], table.fps)
 
 
 class Pin(object):
@@ -239,10 +405,10 @@ class Pin(object):
     Pin contains methods that apply to both inputs and outputs"""
     type = 'Pin'
 
-    def __init__(self, pin, mode=GPIO.IN):
+    def __init__(self, pin, mode=IN):
         self.pin = pin
         self.mode = mode
-        self.last = GPIO.LOW
+        self.last = LOW
         self.handle_change = False
         self.handle_high = False
         self.handle_low = False
@@ -260,8 +426,9 @@ class Pin(object):
         setup_gpio(self.pin, self.mode)
 
     def has_changed(self):
-        if self.read() != self.last:
-            self.last = self.read()
+        value = self.read()
+        if value != self.last:
+            self.last = value
             return True
         return False
 
@@ -287,6 +454,11 @@ class Pin(object):
     def __del__(self):
         pass
 
+    def __getstate__(self):
+        """Only the pin itself is sent to handlers run in another process"""
+        return {'pin': self.pin, 'mode': self.mode, 'name': getattr(self, 'name', None),
+                'last': self.last, '_is_gpio_setup': False}
+
     is_high = is_on
     is_low = is_off
     get = read
@@ -307,13 +479,11 @@ class Motor(object):
             return
 
         self._gpio_is_setup = True
-        setup_gpio(self.pin_fw, GPIO.OUT, initial=GPIO.LOW)
-        setup_gpio(self.pin_bw, GPIO.OUT, initial=GPIO.LOW)
 
-        self.pwm_fw = GPIO.PWM(self.pin_fw, 100)
+        self.pwm_fw = setup_pwm(self.pin_fw, 100)
         self.pwm_fw.start(0)
 
-        self.pwm_bw = GPIO.PWM(self.pin_bw, 100)
+        self.pwm_bw = setup_pwm(self.pin_bw, 100)
         self.pwm_bw.start(0)
 
     def invert(self):
@@ -360,6 +530,10 @@ class Motor(object):
     def stop(self):
         self.speed(0)
 
+    def _timeline_setter(self):
+        """Take the motor over for a Timeline, which sets its speed"""
+        return self.speed
+
     forward = forwards
     backward = backwards
     reverse = invert
@@ -377,43 +551,186 @@ class Input(Pin):
         self.handle_released = None
         self.handle_changed = None
         self.has_callback = False
+        self.edge_buffer = None
+        self.debouncer = None
+        self.counter = None
+        self._debounce_set = False
+        self._listeners = []
 
-        super(Input, self).__init__(pin, GPIO.IN)
+        super(Input, self).__init__(pin, IN)
 
-    def on_high(self, callback, bouncetime=DEBOUNCE_TIME):
+    def on_high(self, callback, bouncetime=None):
         self.handle_pressed = callback
-        self._setup_callback(bouncetime)
+        self._setup_handler(bouncetime)
         return True
 
-    def _setup_callback(self, bouncetime):
+    def _level(self):
+        """Read the pin, through the GPIO level register where it's mapped"""
+        mem = setup_gpiomem()
+        if mem is not None:
+            return (mem.levels() >> self.pin) & 1
+        return GPIO.input(self.pin)
+
+    def _setup_handler(self, bouncetime):
+        """Watch the pin for a handler, debouncing it if it isn't already"""
+        if bouncetime is not None:
+            self.debounce(bouncetime)
+        elif self.debouncer is None and not self._debounce_set:
+            self.debounce(DEBOUNCE_TIME)
+        self._setup_callback()
+
+    def _setup_callback(self):
         if self.has_callback:
             return False
 
+        if self.edge_buffer is None:
+            self.edge_buffer = EdgeBuffer()
+
         def handle_callback(pin):
-            if self.read() == 1 and callable(self.handle_pressed):
-                self.handle_pressed(self)
-            elif self.read() == 0 and callable(self.handle_released):
-                self.handle_released(self)
-            if callable(self.handle_changed):
-                self.handle_changed(self)
+            # Capture the edge before anything else, handlers can take a while
+            timestamp = monotonic_ns()
+            value = self._level()
+            self.edge_buffer.push(timestamp, value)
+
+            for listener in self._listeners:
+                listener(self, timestamp, value)
+
+            debouncer = self.debouncer
+            if debouncer is None:
+                self._handle_level(timestamp, value)
+            else:
+                get_debounce_engine().edge(debouncer, timestamp, value)
 
         self._setup_gpio()
-        GPIO.add_event_detect(self.pin, GPIO.BOTH, callback=handle_callback, bouncetime=bouncetime)
+        self.edge_buffer.level = self._level()
+        if self.debouncer is not None:
+            get_debounce_engine().add(self.debouncer, self.edge_buffer.level)
+
+        # Bouncing is dealt with by debounce(), so every edge is seen
+        GPIO.add_event_detect(self.pin, GPIO.BOTH, callback=handle_callback)
+
         self.has_callback = True
         return True
 
-    def on_low(self, callback, bouncetime=DEBOUNCE_TIME):
+    def _handle_level(self, timestamp, value):
+        if value == 1 and callable(self.handle_pressed):
+            _dispatch(self, self.handle_pressed, self)
+        elif value == 0 and callable(self.handle_released):
+            _dispatch(self, self.handle_released, self)
+        if callable(self.handle_changed):
+            _dispatch(self, self.handle_changed, self)
+
+    def on_low(self, callback, bouncetime=None):
         self.handle_released = callback
-        self._setup_callback(bouncetime)
+        self._setup_handler(bouncetime)
         return True
 
-    def on_changed(self, callback, bouncetime=DEBOUNCE_TIME):
+    def on_changed(self, callback, bouncetime=None):
         self.handle_changed = callback
-        self._setup_callback(bouncetime)
+        self._setup_handler(bouncetime)
+        return True
+
+    def debounce(self, rise=DEBOUNCE_TIME, fall=None):
+        """Set how long the input must hold a new level before handlers see it
+
+        Edges that don't last are dropped, and handlers are called once
+        the input has settled, so read() in a handler sees the new level.
+        Can be changed at any time, taking effect on the next edge.
+
+        @param rise Milliseconds a rising edge must hold, 0 to pass every edge straight on
+        @param fall Milliseconds a falling edge must hold, the same as rise if not given"""
+        if fall is None:
+            fall = rise
+        if rise < 0 or fall < 0:
+            raise ValueError("Debounce times can't be negative")
+
+        self._debounce_set = True
+        rise = int(rise * NANOSECONDS_PER_MS)
+        fall = int(fall * NANOSECONDS_PER_MS)
+
+        if rise == 0 and fall == 0:
+            if self.debouncer is not None:
+                get_debounce_engine().remove(self.debouncer)
+                self.debouncer = None
+        elif self.debouncer is None:
+            self._setup_gpio()
+            self.debouncer = PinDebouncer(self._handle_level, self._level(), rise, fall)
+            get_debounce_engine().add(self.debouncer, self.debouncer.level)
+        else:
+            get_debounce_engine().configure(self.debouncer, rise, fall)
+
+        return True
+
+    def debounced(self):
+        """Returns the level the input last settled at, or its level now without debouncing"""
+        if self.debouncer is None:
+            return self.read()
+        return self.debouncer.level
+
+    def get_debounce_stats(self):
+        """Returns how many edges were seen, dropped as glitches, and settled into a change of level"""
+        if self.debouncer is None:
+            return {'edges': 0, 'glitches': 0, 'transitions': 0}
+        return self.debouncer.get_stats()
+
+    def start_edges(self, size=EDGE_BUFFER_SIZE):
+        """Start recording every edge, for edges() to collect
+
+        Edges are recorded from the moment the pin is watched, with or
+        without handlers, and before they are debounced.
+
+        @param size How many edges to hold before the oldest are dropped"""
+        if self.edge_buffer is None or self.edge_buffer.size != size:
+            self.edge_buffer = EdgeBuffer(size)
+        self._setup_callback()
+        return True
+
+    def edges(self, max_edges=None):
+        """Returns and forgets the edges recorded since the last call, oldest first
+
+        Each edge is a tuple of (timestamp, level), timestamp is from
+        monotonic_ns and level is the level the input changed to.
+
+        @param max_edges Most edges to return, or None for all of them"""
+        if self.edge_buffer is None:
+            self.start_edges()
+        return self.edge_buffer.drain(max_edges)
+
+    def get_edge_stats(self):
+        """Returns counts of edges recorded, dropped when the buffer was full, and inferred"""
+        if self.edge_buffer is None:
+            return EdgeStats().as_dict()
+        return self.edge_buffer.stats.as_dict()
+
+    def start_frequency(self, gate=FREQUENCY_GATE, size=FREQUENCY_BUFFER_SIZE):
+        """Start measuring frequency and pulse width, see explorerhat.frequency
+
+        Edges are taken from the same record as edges(), so only
+        one or the other should be used at a time.
+
+        @param gate Seconds each measurement covers, a new one is ready as each gate ends
+        @param size Most edges to hold between measurements, two for every cycle"""
+        self.start_edges(size)
+        self.edge_buffer.clear()
+        self.counter = FrequencyCounter(self.edge_buffer, gate, monotonic_ns())
         return True
 
+    def stop_frequency(self):
+        self.counter = None
+
+    def frequency(self):
+        """Returns the frequency in Hz over the last gate to end, starting measurement if it isn't already"""
+        return self.get_measurement()['frequency']
+
+    def get_measurement(self):
+        """Returns the last gate's frequency in Hz, period and pulse_width in seconds, duty_cycle
+        as a percentage, how many edges it had and the monotonic_ns time it ended"""
+        if self.counter is None:
+            self.start_frequency()
+        return self.counter.update(monotonic_ns())
+
     def clear_events(self):
-        if self._is_gpio_setup():
+        if self._is_gpio_setup:
             GPIO.remove_event_detect(self.pin)
         self.has_callback = False
 
@@ -423,6 +740,70 @@ class Input(Pin):
     released = on_low
 
 
+class InputCollection(ObjectCollection):
+    """Collection of inputs, which can be sampled together"""
+
+    def __init__(self, **kwargs):
+        ObjectCollection.__init__(self, **kwargs)
+        self._pins = None
+
+    def _setup_pins(self):
+        if self._pins is None:
+            inputs = [self._get(name) for name in self._index]
+            for obj in inputs:
+                obj._setup_gpio()
+            self._pins = [obj.pin for obj in inputs]
+        return self._pins
+
+    def snapshot(self):
+        """Reads every input at the same instant
+
+        Uses a single read of the GPIO level register where the backend
+        can map it, otherwise falls back to reading each pin in turn.
+
+        Returns (timestamp, levels), timestamp is from monotonic_ns and
+        bit n of levels is set if the nth input ( one is bit 0 ) is high"""
+        pins = self._setup_pins()
+        mem = setup_gpiomem()
+        timestamp = monotonic_ns()
+        levels = 0
+
+        if mem is not None:
+            bank = mem.levels()
+            for bit, pin in enumerate(pins):
+                if (bank >> pin) & 1:
+                    levels |= 1 << bit
+        else:
+            for bit, pin in enumerate(pins):
+                if GPIO.input(pin):
+                    levels |= 1 << bit
+
+        return timestamp, levels
+
+    def read(self):
+        """Returns a dictionary of input levels, all taken at the same instant"""
+        levels = self.snapshot()[1]
+        return dict((name, (levels >> bit) & 1) for bit, name in enumerate(self._index))
+
+
+def _pulse_times(transition_on=None, transition_off=None, time_on=None, time_off=None):
+    """Fill in the times Output.pulse() wasn't given
+
+    pulse() = pulse(0.5,0.5,0.5,0.5)
+    pulse(0.5,1.0) = pulse(0.5,1.0,0.5,0.5)
+    pulse(0.5,1.0,1.0) = pulse(0.5,1.0,1.0,1.0)
+    pulse(0.5,1.0,1.0,0.5) = -"""
+    if transition_on is None:
+        transition_on = 0.5
+    if transition_off is None:
+        transition_off = transition_on
+    if time_on is None:
+        time_on = transition_on
+    if time_off is None:
+        time_off = transition_on
+    return transition_on, transition_off, time_on, time_off
+
+
 class Output(Pin):
     """ExplorerHAT class representing a GPIO Output
 
@@ -431,54 +812,86 @@ class Output(Pin):
     type = 'Output'
 
     def __init__(self, pin):
-        super(Output, self).__init__(pin, GPIO.OUT)
+        super(Output, self).__init__(pin, OUT)
 
-        self.pulser = Pulse(self, 0, 0, 0, 0)
+        self.pulser = None
         self.blinking = False
         self.pulsing = False
         self.fading = False
         self.fader = None
+        self._animation = None
         self._value = 0
         self.gpio_pwm = None
+        self._pwm_running = False
 
     def _setup_gpio(self):
         if self._is_gpio_setup:
             return True
 
-        setup_gpio(self.pin, self.mode)
-        self.gpio_pwm = GPIO.PWM(self.pin, PULSE_FREQUENCY)
-        self.gpio_pwm.start(0)
+        self._is_gpio_setup = True
+        self.gpio_pwm = setup_pwm(self.pin, PULSE_FREQUENCY)
+
+    def read(self):
+        self._setup_gpio()
+
+        # A hardware PWM pin isn't set up as a GPIO, and its level would
+        # only be the instant of the cycle it is at, so go by its duty cycle
+        if self.gpio_pwm.hardware:
+            return 1 if self.gpio_pwm.running and self.gpio_pwm.duty_cycle > 0 else 0
+
+        return GPIO.input(self.pin)
+
+    def _release_pwm(self):
+        """Stop soft PWM so the pin can be driven directly
+
+        The pin is left where it is, rather than driven low, so
+        the level written next is its only change."""
+        if self._pwm_running:
+            self.gpio_pwm.release()
+            self._pwm_running = False
+
+    def _prepare_write(self, value):
+        """Stop animation and PWM ahead of setting the pin to value
+
+        Returns False if the pin is on hardware PWM, which can't be
+        driven directly, so has been set with its duty cycle instead."""
+        if value not in (True, False, 1, 0):
+            raise ValueError("You must write a value of 1/True or 0/False")
+
+        self._stop_animation()
+        self._value = value
+
+        if self.gpio_pwm.hardware:
+            self.duty_cycle(100 if value else 0)
+            return False
+
+        self._release_pwm()
+        return True
 
     def __del__(self):
-        if self.gpio_pwm is not None:
+        # A no-op once explorerhat_exit() has stopped the PWM engine
+        if self._pwm_running:
             self.gpio_pwm.stop()
         Pin.__del__(self)
 
-    def fade(self, start, end, duration):
+    def fade(self, start, end, duration, shape='linear'):
         """Fades an LED to a specific brightness over a specific time in seconds
 
         @param self Object pointer.
         @param start Starting brightness %
         @param end Ending brightness %
-        @param duration Time duration ( in seconds ) of the fade"""
+        @param duration Time duration ( in seconds ) of the fade
+        @param shape "linear", "sine", "gamma" or a shape added with waveform.register_shape"""
         self.stop()
-        time_start = time.time()
         self.pwm(PULSE_FREQUENCY, start)
 
-        def _fade():
-            self.fading = True
-
-            if time.time() - time_start >= duration:
-                self.duty_cycle(end)
-                self.fading = False
-                return False
-
-            current = (time.time() - time_start) / duration
-            brightness = start + (float(end-start) * current)
-            self.duty_cycle(round(brightness))
-            time.sleep(1.0 / PULSE_FPS)
+        if self.fader is None:
+            self.fader = Fade(self, start, end, duration, shape)
+        else:
+            self.fader.setup(start, end, duration, shape)
 
-        self.fader = AsyncWorker(_fade)
+        self._animation = self.fader
+        self.fading = True
         self.fader.start()
         return True
 
@@ -508,64 +921,75 @@ class Output(Pin):
 
         return True
 
-    def pulse(self, transition_on=None, transition_off=None, time_on=None, time_off=None):
+    def pulse(self, transition_on=None, transition_off=None, time_on=None, time_off=None, shape='linear'):
         """Pulses an LED
 
         @param self Object pointer.
         @param transition_on Time the transition from 0% to 100% brightness should take
         @param transition_off Time the trantition from 100% to 0% brightness should take
         @param time_on Time the LED should stay at 100% brightness
-        @param time_off Time the LED should stay at 0% brightness"""
+        @param time_off Time the LED should stay at 0% brightness
+        @param shape "linear", "sine", "gamma" or a shape added with waveform.register_shape"""
 
         self.stop()
 
-        # This needs a thread to handle the fade in and out
-
-        # Attempt to cascade parameters
-        # pulse() = pulse(0.5,0.5,0.5,0.5)
-        # pulse(0.5,1.0) = pulse(0.5,1.0,0.5,0.5)
-        # pulse(0.5,1.0,1.0) = pulse(0.5,1.0,1.0,1.0)
-        # pulse(0.5,1.0,1.0,0.5) = -
-
-        if transition_on is None:
-            transition_on = 0.5
-        if transition_off is None:
-            transition_off = transition_on
-        if time_on is None:
-            time_on = transition_on
-        if time_off is None:
-            time_off = transition_on
+        # This needs the animation scheduler to handle the fade in and out
+        transition_on, transition_off, time_on, time_off = _pulse_times(
+            transition_on, transition_off, time_on, time_off)
 
         # pulse(x,y,0,0) is basically just a regular blink
-        # only fire up a thread if we really need it
+        # only schedule an animation if we really need it
         if transition_on == 0 and transition_off == 0:
             self.blink(time_on, time_off)
             self.blinking = True
         else:
+            if self.pulser is None:
+                self.pulser = Pulse(self, 0, 0, 0, 0)
             self.pulser.time_on = time_on
             self.pulser.time_off = time_off
             self.pulser.transition_on = transition_on
             self.pulser.transition_off = transition_off
+            self.pulser.shape = shape
             self.pulser.start()
+            self._animation = self.pulser
             self.pulsing = True
 
         return True
 
     def pwm(self, freq, duty_cycle=50):
-        self.gpio_pwm.ChangeDutyCycle(duty_cycle)
+        self.duty_cycle(duty_cycle)
         self.gpio_pwm.ChangeFrequency(freq)
         return True
 
     def frequency(self, freq):
+        self._setup_gpio()
         self.gpio_pwm.ChangeFrequency(freq)
         return True
 
     def duty_cycle(self, duty_cycle):
-        self.gpio_pwm.ChangeDutyCycle(duty_cycle)
+        self._setup_gpio()
+
+        # PWM only runs while needed, on/off drive the pin directly
+        if self._pwm_running:
+            self.gpio_pwm.ChangeDutyCycle(duty_cycle)
+        else:
+            self.gpio_pwm.start(duty_cycle)
+            self._pwm_running = True
         return True
 
     def stop(self):
         """Spops all animation"""
+        self._stop_animation()
+
+        if self._pwm_running:
+            if self._value:
+                self.duty_cycle(100)
+            else:
+                self.duty_cycle(0)
+
+        return True
+
+    def _stop_animation(self):
         self._setup_gpio()
 
         if self.fading:
@@ -579,20 +1003,31 @@ class Output(Pin):
         if self.blinking:
             self.blinking = False
 
-        if self._value:
-            self.duty_cycle(100)
-        else:
-            self.duty_cycle(0)
-
-        return True
-
     def stop_pulse(self):
-        """Stops the pulsing thread
+        """Stops the pulsing animation
 
         @param self Object pointer."""
         self.pulsing = False
-        self.pulser.stop()
-        self.pulser = Pulse(self, 0, 0, 0, 0)
+        if self.pulser is not None:
+            self.pulser.stop()
+
+    def get_animation_stats(self):
+        """Returns frame timing of the running or most recent pulse or fade
+
+        A dictionary of frames run, achieved and target frames per second,
+        overruns, and mean and maximum jitter with a histogram of jitter
+        in microseconds. None if there's been no pulse or fade.
+
+        @param self Object pointer."""
+        if self._animation is None:
+            return None
+        return self._animation.get_stats()
+
+    def _timeline_setter(self):
+        """Take the output over for a Timeline, which sets its brightness"""
+        self._stop_animation()
+        self.frequency(PULSE_FREQUENCY)
+        return self.duty_cycle
 
     def brightness(self, value):
         if not 0 <= value <= 100:
@@ -602,18 +1037,13 @@ class Output(Pin):
         self.duty_cycle(value)
 
     def write(self, value):
-        if value is not True and value is not False and value is not 1 and value is not 0:
-            raise ValueError("You must write a value of 1/True or 0/False")
-
-        self.stop()
-        self._value = value
-
-        self.frequency(PULSE_FREQUENCY)
+        if not self._prepare_write(value):
+            return True
 
-        if self._value:
-            self.duty_cycle(100)
+        if value:
+            _write_outputs(1 << self.pin, 0)
         else:
-            self.duty_cycle(0)
+            _write_outputs(0, 1 << self.pin)
 
         return True
 
@@ -643,6 +1073,45 @@ class Output(Pin):
         return True
 
 
+class OutputCollection(ObjectCollection):
+    """Collection of outputs, which can be switched together"""
+
+    def write(self, value):
+        """Sets every output at the same instant
+
+        The new levels are applied as one set mask and one clear mask,
+        rather than one output at a time.
+
+        @param value 1/True or 0/False for all outputs, or a dictionary of values by name"""
+        if not isinstance(value, dict):
+            value = dict((name, value) for name in self._index)
+
+        set_mask = clear_mask = 0
+
+        for name, level in value.items():
+            obj = self._get(self._aliases.get(name, name))
+            if not obj._prepare_write(level):
+                continue
+            if level:
+                set_mask |= 1 << obj.pin
+            else:
+                clear_mask |= 1 << obj.pin
+
+        _write_outputs(set_mask, clear_mask)
+        return dict((name, True) for name in value)
+
+    def on(self):
+        """Turns all outputs on together"""
+        return self.write(1)
+
+    def off(self):
+        """Turns all outputs off together"""
+        return self.write(0)
+
+    high = on
+    low = off
+
+
 class Light(Output):
     """ExplorerHAT class representing an onboard LED"""
 
@@ -658,33 +1127,169 @@ class AnalogInput(object):
     def __init__(self, channel):
         self.channel = channel
         self._sensitivity = 0.1
-        self._t_watch = None
+        self._watching = False
+        self._sampling = False
         self.last_value = None
         self._handler = None
+        self._sample_handler = None
+        self._threshold_handler = None
+        self.buffer = None
+
+    def __getstate__(self):
+        """Only the channel itself is sent to handlers run in another process"""
+        return {'channel': self.channel, 'name': getattr(self, 'name', None), 'last_value': self.last_value,
+                '_sensitivity': self._sensitivity, 'buffer': None}
 
     def read(self):
         if not setup_analog():
             raise RuntimeError("Analog is unavailable, check your pHAT/HAT and/or connections!")
         return read_se_adc(self.channel)
 
+    def read_many(self, n, rate=3300):
+        """Reads n samples back-to-back, returning an array of readings in volts
+
+        Uses continuous conversion, so this is much faster than
+        calling read() n times.
+
+        @param n Number of samples to read
+        @param rate ADC data rate in samples per second, from 128 to 3300"""
+        if not setup_analog():
+            raise RuntimeError("Analog is unavailable, check your pHAT/HAT and/or connections!")
+        return _codes_to_volts(ads1015.adc.read_many([self.channel], n, samples_per_second=rate)[0])
+
+    def stream(self, block_size=64, samples_per_second=3300):
+        """Reads the input continuously, yielding blocks of readings in volts
+
+        The ADC is switched into continuous conversion mode, so each
+        sample costs only one bus read. The same block is reused on
+        every iteration, copy it if you need to keep it.
+
+        @param block_size Number of readings per block
+        @param samples_per_second ADC data rate, from 128 to 3300"""
+        if not setup_analog():
+            raise RuntimeError("Analog is unavailable, check your pHAT/HAT and/or connections!")
+        return ads1015.adc.stream(block_size, self.channel, samples_per_second=samples_per_second)
+
+    def _engine(self):
+        if not setup_analog():
+            raise RuntimeError("Analog is unavailable, check your pHAT/HAT and/or connections!")
+        return get_engine(ads1015.adc)
+
     def sensitivity(self, sensitivity):
         self._sensitivity = sensitivity
+        if self._watching:
+            self._engine().set_sensitivity(self.channel, self._handle_change, sensitivity)
+
+    def sample_rate(self, samples_per_second):
+        """Sets how often the shared acquisition engine samples this input
+
+        @param samples_per_second Samples per second, the default is 100"""
+        self._engine().set_rate(self.channel, samples_per_second)
 
     def changed(self, handler, sensitivity=None):
         self._handler = handler
         if sensitivity is not None:
-            self._sensitivity = sensitivity
-        if self._t_watch is None:
-            self._t_watch = AsyncWorker(self._watch)
-            self._t_watch.start()
-
-    def _watch(self):
-        value = self.read()
-        if self.last_value is not None and abs(value-self.last_value) > self._sensitivity:
-            if callable(self._handler):
-                self._handler(self, value)
+            self.sensitivity(sensitivity)
+        if not self._watching:
+            self._engine().on_change(self.channel, self._handle_change, self._sensitivity)
+            self._watching = True
+
+    def sampled(self, handler):
+        """Calls "handler" with every sample taken by the acquisition engine
+
+        @param handler Function accepting the input and its value in volts"""
+        self._sample_handler = handler
+        if not self._sampling:
+            self._engine().on_sample(self.channel, self._handle_sample)
+            self._sampling = True
+
+    def threshold(self, handler, low=None, high=None):
+        """Calls "handler" when the input leaves or returns to the window from low to high volts
+
+        The handler is passed the input, an event of "above", "below" or
+        "inside" and the reading in volts. If the ADC's ALERT/RDY output is
+        wired up, see ADC_ALERT, the ADC's own comparator does the checking,
+        otherwise the acquisition engine checks every sample.
+
+        @param handler Function accepting the input, event and value
+        @param low Lower bound in volts, or None for no lower bound
+        @param high Upper bound in volts, or None for no upper bound"""
+        engine = self._engine()
+
+        if ADC_ALERT is not None and engine.alert_pin is None:
+            # ALERT/RDY is open drain, so needs pulling up
+            setup_gpio(ADC_ALERT, IN, pull_up_down=PUD_UP)
+            engine.set_alert(GPIO, ADC_ALERT)
+
+        self.clear_threshold()
+        self._threshold_handler = handler
+        engine.on_threshold(self.channel, self._handle_threshold, low, high)
+
+    def clear_threshold(self):
+        """Stops calling the handler set by threshold()"""
+        if self._threshold_handler is not None:
+            self._engine().clear_threshold(self.channel, self._handle_threshold)
+            self._threshold_handler = None
+
+    def start_buffer(self, size=1024):
+        """Keeps a history of the last "size" samples taken by the acquisition engine
+
+        Returns a SampleBuffer of (monotonic_ns timestamp, raw code) pairs,
+        see explorerhat.ringbuffer. Requires numpy.
+
+        @param size Number of samples to keep"""
+        from .ringbuffer import SampleBuffer
+
+        self.stop_buffer()
+        self.buffer = SampleBuffer(size)
+        self._engine().add_buffer(self.channel, self.buffer)
+        return self.buffer
+
+    def stop_buffer(self):
+        """Stops adding samples to the buffer created by start_buffer()"""
+        if self.buffer is not None:
+            self._engine().remove_buffer(self.channel, self.buffer)
+            self.buffer = None
+
+    def latest(self):
+        """Returns the most recent sample from the acquisition engine, or None"""
+        return self._engine().latest(self.channel)[1]
+
+    def _handle_change(self, channel, value):
         self.last_value = value
-        time.sleep(0.01)
+        if callable(self._handler):
+            _dispatch(self, self._handler, self, value)
+
+    def _handle_threshold(self, channel, event, value):
+        if callable(self._threshold_handler):
+            _dispatch(self, self._threshold_handler, self, event, value)
+
+    def _handle_sample(self, channel, value):
+        if callable(self._sample_handler):
+            _dispatch(self, self._sample_handler, self, value)
+
+
+class AnalogCollection(ObjectCollection):
+    """Collection of analog inputs, sharing one ADC"""
+
+    def read_many(self, n, rate=3300):
+        """Reads n samples from each input in turn
+
+        Returns a dictionary of arrays of readings in volts, keyed by input name
+
+        @param n Number of samples to read per input
+        @param rate ADC data rate in samples per second, from 128 to 3300"""
+        if not setup_analog():
+            raise RuntimeError("Analog is unavailable, check your pHAT/HAT and/or connections!")
+
+        channels = [self._get(name).channel for name in self._index]
+        results = ads1015.adc.read_many(channels, n, samples_per_second=rate)
+        return dict((name, _codes_to_volts(codes)) for name, codes in zip(self._index, results))
+
+
+def _codes_to_volts(codes, programmable_gain=ads1015.PGA_6_144V):
+    scale = ads1015.code_to_volts(1, programmable_gain)
+    return array('d', [code * scale for code in codes])
 
 
 class CapTouchSettings(object):
@@ -692,7 +1297,18 @@ class CapTouchSettings(object):
 
     @staticmethod
     def enable_multitouch(en=True):
-        _cap1208.enable_multitouch(en)
+        if not setup_captouch():
+            raise RuntimeError("Touch is unavailable, check your pHAT/HAT and/or connections!")
+
+        # Hold the bus so the read-modify-write isn't interleaved,
+        # the register is shadowed so repeat calls don't touch the bus
+        with _cap_shadow.batch() as batch:
+            config = _cap_shadow.read_byte(CAP_MTOUCH_CONFIG, batch)
+            if en:
+                config &= ~CAP_MTOUCH_BLOCK
+            else:
+                config |= CAP_MTOUCH_BLOCK
+            _cap_shadow.write_byte(CAP_MTOUCH_CONFIG, config, bus=batch)
 
 
 class CapTouchInput(object):
@@ -704,6 +1320,7 @@ class CapTouchInput(object):
         self._held = False
         self.channel = channel
         self.handlers = {'press': None, 'release': None, 'held': None}
+        self._listeners = []
         self._captouch_is_setup = False
 
     def _setup_captouch(self):
@@ -727,8 +1344,10 @@ class CapTouchInput(object):
             elif event in ['release', 'none']:
                 self._pressed = False
                 self._held = False
+            for listener in self._listeners:
+                listener(self, event)
             if callable(self.handlers[event]):
-                self.handlers[event](self.alias, event)
+                _dispatch(self, self.handlers[event], self.alias, event)
 
     def is_pressed(self):
         if not self._setup_captouch():
@@ -764,12 +1383,26 @@ running = False
 workers = {}
 
 
-def async_start(name, function):
+def async_start(name, function, interval=None):
+    """Runs function repeatedly in the background until it returns False
+
+    @param name Name to pause, resume or stop the task by
+    @param function Function to run
+    @param interval Seconds from the start of one call to the next, or None to call it back to back"""
     global workers
-    workers[name] = AsyncWorker(function)
+    workers[name] = AsyncWorker(function, interval, name)
     workers[name].start()
     return True
 
+def async_pause(name):
+    """Holds a task between calls, its thread sleeps until the task is resumed or stopped"""
+    workers[name].pause()
+    return True
+
+def async_resume(name):
+    workers[name].resume()
+    return True
+
 def async_stop(name):
     global workers
     workers[name].stop()
@@ -792,6 +1425,7 @@ def set_timeout(function, seconds):
     return True
 
 def pause():
+    import signal
     signal.pause()
 
 def loop(callback):
@@ -807,46 +1441,49 @@ def stop():
 
 
 settings = ObjectCollection()
-settings._add(touch=CapTouchSettings())
+settings._add_lazy(touch=CapTouchSettings)
 
-light = ObjectCollection()
-light._add(blue=Light(LED1))
-light._add(yellow=Light(LED2))
-light._add(red=Light(LED3))
-light._add(green=Light(LED4))
+light = OutputCollection()
+light._add_lazy(blue=lambda: Light(LED1))
+light._add_lazy(yellow=lambda: Light(LED2))
+light._add_lazy(red=lambda: Light(LED3))
+light._add_lazy(green=lambda: Light(LED4))
 light._alias(amber='yellow')
 
-output = ObjectCollection()
-output._add(one=Output(OUT1))
-output._add(two=Output(OUT2))
-output._add(three=Output(OUT3))
-output._add(four=Output(OUT4))
+output = OutputCollection()
+output._add_lazy(one=lambda: Output(OUT1))
+output._add_lazy(two=lambda: Output(OUT2))
+output._add_lazy(three=lambda: Output(OUT3))
+output._add_lazy(four=lambda: Output(OUT4))
+
+# Apply each animation frame's PWM changes together
+set_frame_batch(_pwm_frame_batch)
 
-input = ObjectCollection()
-input._add(one=Input(IN1))
-input._add(two=Input(IN2))
-input._add(three=Input(IN3))
-input._add(four=Input(IN4))
+input = InputCollection()
+input._add_lazy(one=lambda: Input(IN1))
+input._add_lazy(two=lambda: Input(IN2))
+input._add_lazy(three=lambda: Input(IN3))
+input._add_lazy(four=lambda: Input(IN4))
 
 touch = ObjectCollection()
-touch._add(one=CapTouchInput(4, 1))
-touch._add(two=CapTouchInput(5, 2))
-touch._add(three=CapTouchInput(6, 3))
-touch._add(four=CapTouchInput(7, 4))
-touch._add(five=CapTouchInput(0, 5))
-touch._add(six=CapTouchInput(1, 6))
-touch._add(seven=CapTouchInput(2, 7))
-touch._add(eight=CapTouchInput(3, 8))
+touch._add_lazy(one=lambda: CapTouchInput(4, 1))
+touch._add_lazy(two=lambda: CapTouchInput(5, 2))
+touch._add_lazy(three=lambda: CapTouchInput(6, 3))
+touch._add_lazy(four=lambda: CapTouchInput(7, 4))
+touch._add_lazy(five=lambda: CapTouchInput(0, 5))
+touch._add_lazy(six=lambda: CapTouchInput(1, 6))
+touch._add_lazy(seven=lambda: CapTouchInput(2, 7))
+touch._add_lazy(eight=lambda: CapTouchInput(3, 8))
 
 motor = ObjectCollection()
-motor._add(one=Motor(M1F, M1B))
-motor._add(two=Motor(M2F, M2B))
-
-analog = ObjectCollection()
-analog._add(one=AnalogInput(3))
-analog._add(two=AnalogInput(2))
-analog._add(three=AnalogInput(1))
-analog._add(four=AnalogInput(0))
+motor._add_lazy(one=lambda: Motor(M1F, M1B))
+motor._add_lazy(two=lambda: Motor(M2F, M2B))
+
+analog = AnalogCollection()
+analog._add_lazy(one=lambda: AnalogInput(3))
+analog._add_lazy(two=lambda: AnalogInput(2))
+analog._add_lazy(three=lambda: AnalogInput(1))
+analog._add_lazy(four=lambda: AnalogInput(0))
 
 _help = {
     'index': '''Call with "explorerhat.help(topic)" for help with:
@@ -0,0 +1,362 @@
+"""Shared analog acquisition engine
+
+One thread samples every watched ADS1015 channel, round-robin
+in deadline order so each channel gets its own sample rate
+while the converter is never asked for more than max_rate
+conversions per second in total."""
+
+import threading
+
+from .ads1015 import CODE_MAX, CODE_MIN, PGA_6_144V, code_to_volts, window_codes
+from .backend import BOTH
+from .pins import StoppableThread, clock, monotonic_ns, print_exception
+
+
+# Per-channel and aggregate defaults, in samples per second
+CHANNEL_RATE = 100
+MAX_RATE = 1600
+
+# ADC data rate, also used for continuous conversion when only one channel is watched
+DATA_RATE = 1600
+
+
+class Threshold(object):
+    """Window threshold subscriber, tracks which side of the window a channel is on"""
+    def __init__(self, handler, low=None, high=None):
+        self.handler = handler
+        self.low = float('-inf') if low is None else low
+        self.high = float('inf') if high is None else high
+        self.state = None
+
+    def classify(self, value):
+        if value > self.high:
+            return 'above'
+        if value < self.low:
+            return 'below'
+        return 'inside'
+
+    def update(self, channel, value):
+        """Call handler(channel, event, value) if value has crossed the window
+
+        The first value only produces an event if it is outside."""
+        state = self.classify(value)
+        last_state, self.state = self.state, state
+
+        if state == last_state or (last_state is None and state == 'inside'):
+            return
+
+        try:
+            self.handler(channel, state, value)
+        except Exception:
+            print_exception()
+
+
+class Channel(object):
+    """Sampling state and subscribers for one ADC channel"""
+    def __init__(self, channel, rate=CHANNEL_RATE):
+        self.channel = channel
+        self.rate = rate
+        self.deadline = clock()
+        self.value = None
+        self.timestamp = None
+        self.sample_handlers = []
+        self.change_handlers = []
+        self.thresholds = []
+        self.buffers = []
+
+    @property
+    def interval(self):
+        return 1.0 / self.rate
+
+    def has_subscribers(self):
+        return bool(self.sample_handlers or self.change_handlers or self.thresholds or self.buffers)
+
+
+class AcquisitionEngine(StoppableThread):
+    """Samples subscribed channels from a single thread
+
+    Handlers are called from the engine thread, a sample handler
+    receives (channel, value) and a change handler is only called
+    when the value moves by more than its sensitivity.
+
+    Thresholds use the ADS1015 window comparator when its ALERT/RDY
+    output is wired to a GPIO, see set_alert(), so no samples are
+    taken for them. Otherwise they are checked against each sample."""
+    def __init__(self, adc, max_rate=MAX_RATE):
+        StoppableThread.__init__(self, 'explorerhat-analog')
+        self.adc = adc
+        self.max_rate = max_rate
+        self.channels = {}
+        self.gpio = None
+        self.alert_pin = None
+        self.comparator = None
+        self._continuous = None
+        self._cond = threading.Condition()
+        self._alert_lock = threading.RLock()
+
+    def _channel(self, channel):
+        if channel not in self.channels:
+            self.channels[channel] = Channel(channel)
+        return self.channels[channel]
+
+    def set_rate(self, channel, rate):
+        """Set the sample rate of one channel"""
+        if rate <= 0:
+            raise ValueError("Sample rate must be greater than 0")
+        with self._cond:
+            self._channel(channel).rate = rate
+            self._cond.notify()
+
+    def on_sample(self, channel, handler):
+        """Call handler(channel, value) with every new sample"""
+        with self._cond:
+            self._channel(channel).sample_handlers.append(handler)
+            self._cond.notify()
+
+    def on_change(self, channel, handler, sensitivity):
+        """Call handler(channel, value) when a sample differs from the last by more than sensitivity"""
+        with self._cond:
+            self._channel(channel).change_handlers.append([handler, sensitivity])
+            self._cond.notify()
+
+    def set_sensitivity(self, channel, handler, sensitivity):
+        with self._cond:
+            for subscriber in self._channel(channel).change_handlers:
+                if subscriber[0] == handler:
+                    subscriber[1] = sensitivity
+
+    def unsubscribe(self, channel, handler):
+        """Remove handler from both the sample and change subscribers of channel"""
+        with self._cond:
+            state = self._channel(channel)
+            state.sample_handlers = [h for h in state.sample_handlers if h != handler]
+            state.change_handlers = [s for s in state.change_handlers if s[0] != handler]
+
+    def add_buffer(self, channel, buffer):
+        """Append every sample of channel to buffer, see ringbuffer.SampleBuffer"""
+        with self._cond:
+            self._channel(channel).buffers.append(buffer)
+            self._cond.notify()
+
+    def remove_buffer(self, channel, buffer):
+        with self._cond:
+            state = self._channel(channel)
+            state.buffers = [b for b in state.buffers if b is not buffer]
+
+    def set_alert(self, gpio, pin):
+        """Use the ADS1015 ALERT/RDY output, wired to pin, for threshold events"""
+        self.gpio = gpio
+        self.alert_pin = pin
+
+    def on_threshold(self, channel, handler, low=None, high=None):
+        """Call handler(channel, event, value) when channel leaves or re-enters low..high volts
+
+        event is one of 'above', 'below' or 'inside'. Only one channel
+        at a time can use the hardware comparator, any others are polled."""
+        threshold = Threshold(handler, low, high)
+
+        with self._cond:
+            if self.alert_pin is not None and self.comparator is None:
+                self.comparator = (channel, threshold)
+                self.adc.start_comparator(channel, low, high)
+                self.gpio.add_event_detect(self.alert_pin, BOTH, callback=self._handle_alert)
+            else:
+                self._channel(channel).thresholds.append(threshold)
+                self._cond.notify()
+                return
+
+        # Report the starting state if already outside the window
+        self._handle_alert(self.alert_pin)
+
+    def clear_threshold(self, channel, handler):
+        """Remove a threshold subscriber, releasing the comparator if it was using it"""
+        with self._alert_lock, self._cond:
+            state = self._channel(channel)
+            state.thresholds = [t for t in state.thresholds if t.handler != handler]
+
+            if self.comparator is not None and self.comparator[0] == channel and self.comparator[1].handler == handler:
+                self.gpio.remove_event_detect(self.alert_pin)
+                self.comparator = None
+                self.adc.stop_comparator()
+
+    def _handle_alert(self, pin):
+        """Check the comparator's channel and move the window around its new state
+
+        A window comparator only says the reading left the window, not
+        which way, so once a state is reported the window is moved to
+        its boundaries, e.g. from high up once above. That is repeated
+        until a fresh reading matches, as a crossing while the window
+        moves holds ALERT/RDY where it was and produces no new edge."""
+        with self._alert_lock:
+            comparator = self.comparator
+            while comparator is not None and self.comparator is comparator:
+                channel, threshold = comparator
+                value = self.adc.read_comparator()
+
+                # Paused by another read, this is checked again once it resumes
+                if value is None:
+                    return
+
+                if threshold.state is not None and threshold.classify(value) == threshold.state:
+                    return
+
+                threshold.update(channel, value)
+                self._arm(threshold)
+
+    def _arm(self, threshold):
+        """Set the comparator window to the boundaries of threshold's current state"""
+        low, high = window_codes(threshold.low, threshold.high)
+
+        if threshold.state == 'above':
+            low, high = high + 1, CODE_MAX
+        elif threshold.state == 'below':
+            low, high = CODE_MIN, low - 1
+
+        self.adc.set_comparator_window(low, high)
+
+    def latest(self, channel):
+        """Return (timestamp, value) of the most recent sample, or (None, None)
+
+        timestamp is from monotonic_ns, the same as in sample buffers."""
+        state = self.channels.get(channel)
+        if state is None:
+            return None, None
+        return state.timestamp, state.value
+
+    def stop(self):
+        if self.is_alive():
+            with self._cond:
+                self.stop_event.set()
+                self._cond.notify()
+            self.join()
+
+    def _next_channel(self):
+        """Wait for the channel with the earliest deadline to fall due"""
+        with self._cond:
+            while not self.stop_event.is_set():
+                active = [state for state in self.channels.values() if state.has_subscribers()]
+
+                if not active:
+                    self._stop_continuous()
+                    self._cond.wait()
+                    self.wakeups += 1
+                    continue
+
+                state = min(active, key=lambda s: s.deadline)
+                delay = state.deadline - clock()
+
+                if delay > 0:
+                    self._cond.wait(delay)
+                    self.wakeups += 1
+                    continue
+
+                subscribers = (list(state.sample_handlers), [list(s) for s in state.change_handlers],
+                               list(state.thresholds), list(state.buffers))
+
+                return state, len(active) == 1, subscribers
+
+        return None, None, None
+
+    def _read(self, channel, solo):
+        """Read a channel, leaving the ADC converting it if it is the only one watched
+
+        Continuous conversion means each sample is a single bus read
+        with no config write, until another channel needs the ADC."""
+        if solo and self.adc.comparator is None:
+            self._continuous = (channel, PGA_6_144V, DATA_RATE)
+            self.adc.start_continuous(*self._continuous)
+            return self.adc.read_raw(channel, PGA_6_144V, DATA_RATE)
+
+        with self.adc.lock:
+            # The single-shot read ends continuous conversion, so no need to power down first
+            self._stop_continuous(power_down=False)
+            return self.adc.read_raw(channel, PGA_6_144V, DATA_RATE)
+
+    def _stop_continuous(self, power_down=True):
+        if self._continuous is not None:
+            with self.adc.lock:
+                if self.adc.continuous == self._continuous:
+                    self.adc.stop_continuous(power_down)
+            self._continuous = None
+
+    def run(self):
+        last_conversion = 0
+
+        while not self.stop_event.is_set():
+            state, solo, subscribers = self._next_channel()
+            if state is None:
+                break
+
+            sample_handlers, change_handlers, thresholds, buffers = subscribers
+
+            # Respect the aggregate conversion rate
+            delay = last_conversion + (1.0 / self.max_rate) - clock()
+            if delay > 0:
+                self.stop_event.wait(delay)
+                self.wakeups += 1
+
+            last_conversion = clock()
+
+            try:
+                timestamp = monotonic_ns()
+                code = self._read(state.channel, solo)
+            except IOError:
+                print_exception()
+                code = None
+
+            # Skip ahead rather than bursting to catch up when overloaded
+            state.deadline = max(state.deadline + state.interval, last_conversion)
+
+            if code is None:
+                continue
+
+            for buffer in buffers:
+                buffer.append(timestamp, code)
+
+            value = code_to_volts(code, PGA_6_144V)
+
+            last_value = state.value
+            state.value = value
+            state.timestamp = timestamp
+
+            for handler in sample_handlers:
+                self._call(handler, state.channel, value)
+
+            for threshold in thresholds:
+                threshold.update(state.channel, value)
+
+            if last_value is None:
+                continue
+
+            for handler, sensitivity in change_handlers:
+                if abs(value - last_value) > sensitivity:
+                    self._call(handler, state.channel, value)
+
+    def _call(self, handler, channel, value):
+        try:
+            handler(channel, value)
+        except Exception:
+            print_exception()
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine(adc):
+    """Return the shared acquisition engine, creating it on first use"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = AcquisitionEngine(adc)
+            _engine.start()
+        return _engine
+
+
+def stop_engine():
+    """Stop the shared acquisition engine"""
+    global _engine
+    with _engine_lock:
+        if _engine is not None:
+            _engine.stop()
+            _engine = None
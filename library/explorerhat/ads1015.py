@@ -1,28 +1,17 @@
+import math
+import threading
 import time
-from sys import exit, version_info
-
-try:
-    from smbus import SMBus
-except ImportError:
-    if version_info[0] < 3:
-        exit("This library requires python-smbus\nInstall with: sudo apt-get install python-smbus")
-    elif version_info[0] == 3:
-        exit("This library requires python3-smbus\nInstall with: sudo apt-get install python3-smbus")
-
-
-adc_available = True
-
-
-def i2c_bus_id():
-    revision = ([l[12:-1] for l in open('/proc/cpuinfo', 'r').readlines() if l[:8] == "Revision"] + ['0000'])[0]
-    return 1 if int(revision, 16) >= 4 else 0
+from array import array
 
+from .i2c import I2CBus, RegisterShadow
+from .pins import clock
 
 address = 0x48
-i2c = SMBus(i2c_bus_id())
 
 REG_CONV = 0x00
 REG_CFG = 0x01
+REG_LO_THRESH = 0x02
+REG_HI_THRESH = 0x03
 
 samples_per_second_map = {128: 0x0000, 250: 0x0020, 490: 0x0040, 920: 0x0060, 1600: 0x0080, 2400: 0x00A0, 3300: 0x00C0}
 channel_map = {0: 0x4000, 1: 0x5000, 2: 0x6000, 3: 0x7000}
@@ -36,29 +25,437 @@ PGA_0_512V = 512
 PGA_0_256V = 256
 
 
-def read_se_adc(channel=1, programmable_gain=PGA_6_144V, samples_per_second=1600):
+MODE_SINGLE_SHOT = 0x0100
+OS_START = 0x8000
+
+# Comparator, ALERT/RDY is active low and non-latching
+COMP_WINDOW = 0x0010
+COMP_QUEUE_1 = 0x0000
+COMP_DISABLE = 0x0003
+
+# Range of the 12-bit conversion result
+CODE_MIN = -2048
+CODE_MAX = 2047
+
+# Conversion periods to wait before trusting REG_CONV once the comparator
+# is re-armed, allowing for the oscillator's 10% tolerance
+COMPARATOR_SETTLE = 1.1
+
+
+def _build_config_word(channel, programmable_gain, samples_per_second, single_shot=True, comparator=COMP_DISABLE):
     # sane defaults
-    config = 0x0003 | 0x0100
+    config = comparator
 
     config |= samples_per_second_map[samples_per_second]
     config |= channel_map[channel]
     config |= programmable_gain_map[programmable_gain]
 
-    # set "single shot" mode
-    config |= 0x8000
+    if single_shot:
+        # set "single shot" mode
+        config |= MODE_SINGLE_SHOT | OS_START
+
+    return config
+
+
+# Every comparator-disabled config, keyed by (channel, gain, rate, single_shot)
+config_words = dict(
+    ((channel, programmable_gain, samples_per_second, single_shot),
+     _build_config_word(channel, programmable_gain, samples_per_second, single_shot))
+    for channel in channel_map
+    for programmable_gain in programmable_gain_map
+    for samples_per_second in samples_per_second_map
+    for single_shot in (True, False))
+
+
+def config_word(channel, programmable_gain, samples_per_second, single_shot=True, comparator=COMP_DISABLE):
+    """Return a REG_CFG value, comparator disabled by default"""
+    if comparator == COMP_DISABLE:
+        return config_words[(channel, programmable_gain, samples_per_second, single_shot)]
+    return _build_config_word(channel, programmable_gain, samples_per_second, single_shot, comparator)
+
+
+def code_to_volts(code, programmable_gain=PGA_6_144V):
+    return code * programmable_gain / 2048.0 / 1000.0
+
+
+def volts_to_code(volts, programmable_gain=PGA_6_144V):
+    code = int(round(volts * 1000.0 * 2048.0 / programmable_gain))
+    return max(-2048, min(2047, code))
+
+
+def window_codes(low, high, programmable_gain=PGA_6_144V):
+    """Return (low, high) threshold codes for a window of low..high volts
+
+    The window comparator alerts on a code below low or above high,
+    these are the codes for which code_to_volts() is below low or
+    above high volts. None or an infinite bound leaves that side open."""
+    scale = 1000.0 * 2048.0 / programmable_gain
+
+    low_code = CODE_MIN
+    if low is not None and not math.isinf(low):
+        low_code = max(CODE_MIN, min(CODE_MAX + 1, int(math.ceil(low * scale))))
+
+    high_code = CODE_MAX
+    if high is not None and not math.isinf(high):
+        high_code = max(CODE_MIN - 1, min(CODE_MAX, int(math.floor(high * scale))))
+
+    return low_code, high_code
+
+
+# Conversion-ready polling, see ADS1015._wait_for_conversion()
+POLL_AFTER = 0.8
+POLL_INTERVAL_MIN = 0.00005
+CONVERSION_TIMEOUT = 2.0
+
+
+class ReadStats(object):
+    """Single-shot read latency counters for one data rate"""
+    def __init__(self, samples_per_second):
+        self.samples_per_second = samples_per_second
+        self.reset()
+
+    def reset(self):
+        self.reads = 0
+        self.polls = 0
+        self.timeouts = 0
+        self.total_latency = 0.0
+        self.min_latency = None
+        self.max_latency = 0.0
+
+    def record(self, latency, polls, timed_out):
+        self.reads += 1
+        self.polls += polls
+        self.timeouts += timed_out
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+        if self.min_latency is None or latency < self.min_latency:
+            self.min_latency = latency
+
+    def as_dict(self):
+        mean = self.total_latency / self.reads if self.reads else None
+        return {
+            'reads': self.reads,
+            'polls': self.polls,
+            'timeouts': self.timeouts,
+            'mean_latency': mean,
+            'min_latency': self.min_latency,
+            'max_latency': self.max_latency,
+            'achieved_samples_per_second': 1.0 / mean if mean else None
+        }
+
+
+class ADS1015(object):
+    """ADS1015 analog to digital converter on an SMBus compatible bus"""
+    def __init__(self, i2c, i2c_addr=address):
+        if not isinstance(i2c, I2CBus):
+            i2c = I2CBus(i2c)
+
+        self.i2c = i2c
+        self.address = i2c_addr
+        self.shadow = RegisterShadow(i2c, i2c_addr)
+        self.lock = threading.RLock()
+        self.continuous = None
+        self.comparator = None
+        self._comparator_settled = 0
+        self.stats = dict((rate, ReadStats(rate)) for rate in samples_per_second_map)
+
+    def _write_register(self, register, value, bus=None):
+        return self.shadow.write_word(register, value, bus=bus)
+
+    def _write_config(self, config, bus=None):
+        # Setting OS starts a conversion, so must always be written
+        self.shadow.write_word(REG_CFG, config, force=bool(config & OS_START), bus=bus)
+
+    def _read_code(self):
+        data = self.i2c.read_i2c_block_data(self.address, REG_CONV, 2)
+        return ((data[0] << 8) | data[1]) >> 4
+
+    def _conversion_ready(self):
+        data = self.i2c.read_i2c_block_data(self.address, REG_CFG, 2)
+        return bool(data[0] & 0x80)
+
+    def _wait_for_conversion(self, samples_per_second):
+        """Wait for a single-shot conversion by polling the OS bit
+
+        Sleeps for most of the nominal conversion time, then polls with
+        a doubling interval. The ADS1015 oscillator is only accurate to
+        10%, so this avoids both reading too early and waiting on a
+        fixed pessimistic delay. Returns (polls, timed_out)."""
+        conversion_time = 1.0 / samples_per_second
+        start = clock()
+        deadline = start + conversion_time * CONVERSION_TIMEOUT + 0.001
+        interval = POLL_INTERVAL_MIN
+        polls = 0
+
+        time.sleep(conversion_time * POLL_AFTER)
+
+        while True:
+            polls += 1
+            if self._conversion_ready():
+                return polls, False
+
+            now = clock()
+            if now >= deadline:
+                return polls, True
+
+            time.sleep(min(interval, deadline - now))
+            interval = min(interval * 2, conversion_time / 4)
+
+    def read_se_adc(self, channel=1, programmable_gain=PGA_6_144V, samples_per_second=1600):
+        return code_to_volts(self.read_raw(channel, programmable_gain, samples_per_second), programmable_gain)
+
+    def read_raw(self, channel=1, programmable_gain=PGA_6_144V, samples_per_second=1600):
+        """Take a reading, returning the raw 12-bit code
+
+        If the channel is already being converted continuously with the
+        same settings the latest conversion is read without touching the
+        config, otherwise a single-shot conversion is started. Raises
+        IOError if the conversion doesn't finish, see ReadStats.timeouts."""
+        with self.lock:
+            if self.continuous == (channel, programmable_gain, samples_per_second):
+                return self._read_code()
+
+            start = clock()
+
+            # write single conversion flag, this also ends continuous mode
+            self._comparator_settled = None
+            self._write_config(config_word(channel, programmable_gain, samples_per_second))
+            self.continuous = None
+
+            polls, timed_out = self._wait_for_conversion(samples_per_second)
+
+            # REG_CONV still holds the previous conversion if this one never finished
+            code = None if timed_out else self._read_code()
+            self.stats[samples_per_second].record(clock() - start, polls, timed_out)
+
+            self._resume_comparator()
+
+            if timed_out:
+                raise IOError("Timed out waiting for ADS1015 conversion of channel {}".format(channel))
+            return code
+
+    def get_stats(self):
+        """Return single-shot read counters for each data rate that has been used
+
+        Includes the achieved samples per second, based on mean read latency."""
+        return dict((rate, stats.as_dict()) for rate, stats in self.stats.items() if stats.reads)
+
+    def reset_stats(self):
+        for stats in self.stats.values():
+            stats.reset()
+
+    def get_shadow_stats(self):
+        """Return the number of register writes made, and those skipped as unchanged or unneeded"""
+        return self.shadow.get_stats()
+
+    def start_continuous(self, channel=1, programmable_gain=PGA_6_144V, samples_per_second=3300):
+        """Switch to continuous conversion of one channel
+
+        The config is only written if the channel, gain or rate differ
+        from the conversion already running."""
+        settings = (channel, programmable_gain, samples_per_second)
+
+        with self.lock:
+            if self.continuous == settings:
+                return
+
+            self._comparator_settled = None
+            self._write_config(config_word(channel, programmable_gain, samples_per_second, single_shot=False))
+            self.continuous = settings
+
+            # Let the first conversion complete
+            time.sleep((1.0 / samples_per_second) + 0.0001)
+
+    def stop_continuous(self, power_down=True):
+        """Return to power-down single shot mode
+
+        Pass power_down=False when a single-shot read follows straight
+        away, as starting it ends continuous conversion anyway. The
+        power-down write is also skipped if the comparator is re-armed,
+        either way it is counted as elided, see get_shadow_stats()."""
+        with self.lock:
+            if self.continuous is None:
+                return
+
+            channel, programmable_gain, samples_per_second = self.continuous
+            self.continuous = None
+
+            # The read re-arms the comparator once it is done
+            if not power_down:
+                self.shadow.elide()
+                return
+
+            if self.comparator is None:
+                self._write_config(config_word(channel, programmable_gain, samples_per_second) & ~OS_START)
+            else:
+                self.shadow.elide()
+            self._resume_comparator()
+
+    def start_comparator(self, channel, low, high, programmable_gain=PGA_6_144V, samples_per_second=1600):
+        """Continuously convert one channel with the window comparator enabled
+
+        ALERT/RDY is pulled low while the reading is below low or above
+        high volts, and released when it returns inside the window.
+        Single-shot reads of other channels pause the comparator, it
+        is re-armed once they complete."""
+        # The thresholds and config go out together once both thresholds are set
+        with self.lock, self.shadow.batch() as batch:
+            self.comparator = (channel, programmable_gain, samples_per_second)
+            self.continuous = None
+            self.set_comparator_window(*window_codes(low, high, programmable_gain), bus=batch)
+            self._resume_comparator(batch)
+
+    def set_comparator_window(self, low_code, high_code, bus=None):
+        """Move the comparator window, see window_codes()
+
+        ALERT/RDY is asserted while the code is below low_code or above
+        high_code, CODE_MIN and CODE_MAX leave a side of the window open."""
+        with self.lock:
+            written = self._write_register(REG_LO_THRESH, (max(CODE_MIN, min(CODE_MAX, low_code)) << 4) & 0xFFFF, bus)
+            written |= self._write_register(REG_HI_THRESH, (max(CODE_MIN, min(CODE_MAX, high_code)) << 4) & 0xFFFF, bus)
+            if written and self._comparator_settled is not None and self.comparator is not None:
+                self._comparator_settling()
+
+    def stop_comparator(self):
+        """Disable the comparator and return to power-down single shot mode"""
+        with self.lock:
+            if self.comparator is None:
+                return
+
+            channel, programmable_gain, samples_per_second = self.comparator
+            self.comparator = None
+            self._write_config(config_word(channel, programmable_gain, samples_per_second) & ~OS_START)
+
+    def read_comparator(self):
+        """Return the latest reading of the channel being compared, in volts
+
+        Returns None while the comparator is paused by another read, as
+        REG_CONV holds some other conversion. Straight after it is re-armed
+        REG_CONV may still hold one, or one compared against the old window,
+        so this waits for the next conversion first."""
+        with self.lock:
+            if self.comparator is None:
+                raise RuntimeError("Comparator is not running, call start_comparator() first")
+
+            if self._comparator_settled is None:
+                return None
+
+            delay = self._comparator_settled - clock()
+            if delay > 0:
+                time.sleep(delay)
+
+            return code_to_volts(self._read_code(), self.comparator[1])
+
+    def _comparator_settling(self):
+        self._comparator_settled = clock() + COMPARATOR_SETTLE / self.comparator[2]
+
+    def _resume_comparator(self, bus=None):
+        if self.comparator is None or self.continuous is not None:
+            return
+
+        channel, programmable_gain, samples_per_second = self.comparator
+        self._comparator_settling()
+        self._write_config(config_word(channel, programmable_gain, samples_per_second,
+                                       single_shot=False, comparator=COMP_WINDOW | COMP_QUEUE_1), bus)
+
+    def read_block(self, buffer, count=None):
+        """Fill buffer with raw codes from the running continuous conversion
+
+        Reads REG_CONV back-to-back, paced to the data rate so each
+        sample is a fresh conversion. Returns the number of samples read."""
+        if count is None:
+            count = len(buffer)
+
+        with self.lock:
+            if self.continuous is None:
+                raise RuntimeError("Continuous conversion is not running, call start_continuous() first")
+
+            interval = 1.0 / self.continuous[2]
+            read_code = self._read_code
+            deadline = clock()
+
+            for i in range(count):
+                delay = deadline - clock()
+                if delay > 0:
+                    time.sleep(delay)
+                buffer[i] = read_code()
+                deadline += interval
+
+        return count
+
+    def read_many(self, channels, count, programmable_gain=PGA_6_144V, samples_per_second=3300):
+        """Read count raw codes from each channel in turn using continuous conversion
+
+        Costs one config write per channel plus one to power down,
+        rather than a write, wait and read per sample. Returns a list
+        of arrays, one per channel."""
+        results = []
+
+        with self.lock:
+            try:
+                for channel in channels:
+                    codes = array('h', [0]) * count
+                    self.start_continuous(channel, programmable_gain, samples_per_second)
+                    self.read_block(codes)
+                    results.append(codes)
+            finally:
+                self.stop_continuous()
+
+        return results
+
+    def stream(self, block_size=64, channel=1, programmable_gain=PGA_6_144V, samples_per_second=3300):
+        """Yield blocks of readings in volts from continuous conversion
+
+        The same preallocated block is yielded every time, copy it to keep it.
+        Conversion stops once the generator is closed or garbage collected."""
+        codes = array('h', [0] * block_size)
+        volts = array('d', [0.0] * block_size)
+        scale = code_to_volts(1, programmable_gain)
+
+        try:
+            while True:
+                with self.lock:
+                    self.start_continuous(channel, programmable_gain, samples_per_second)
+                    self.read_block(codes)
+
+                for i in range(block_size):
+                    volts[i] = codes[i] * scale
+
+                yield volts
+        finally:
+            self.stop_continuous()
+
+    def is_available(self):
+        try:
+            self.read_se_adc()
+        except IOError:
+            return False
+        return True
+
+
+adc = None
+adc_available = False
+
+
+def setup(i2c):
+    """Attach to the ADS1015 on the given bus and probe for it"""
+    global adc, adc_available
+    adc = ADS1015(i2c)
+    adc_available = adc.is_available()
+    return adc_available
+
+
+def read_se_adc(channel=1, programmable_gain=PGA_6_144V, samples_per_second=1600):
+    return adc.read_se_adc(channel, programmable_gain, samples_per_second)
 
-    # write single conversion flag
-    i2c.write_i2c_block_data(address, REG_CFG, [(config >> 8) & 0xFF, config & 0xFF])
 
-    delay = (1.0 / samples_per_second) + 0.0001
-    time.sleep(delay)
+def get_stats():
+    return adc.get_stats()
 
-    data = i2c.read_i2c_block_data(address, REG_CONV)
 
-    return (((data[0] << 8) | data[1]) >> 4) * programmable_gain / 2048.0 / 1000.0
+def reset_stats():
+    adc.reset_stats()
 
 
-try:
-    read_se_adc()
-except IOError:
-    adc_available = False
+def get_shadow_stats():
+    return adc.get_shadow_stats()
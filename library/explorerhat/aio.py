@@ -0,0 +1,238 @@
+"""asyncio interface to Explorer HAT
+
+Input, touch and analog events arrive as async iterators, fades,
+pulses and analog reads can be awaited, and timers run on the event
+loop rather than on threads of their own:
+
+    import explorerhat.aio as aio
+
+    async def main():
+        async with aio.input_events() as events:
+            async for event in events:
+                await aio.fade(explorerhat.light.red, 100, 0, 0.5)
+
+Events are handed to the loop with call_soon_threadsafe() from the
+thread that saw them, so nothing blocks there waiting for the loop.
+
+Requires Python 3.5 or later, and is only loaded when imported."""
+
+import asyncio
+from collections import namedtuple
+
+import explorerhat
+
+from .pins import monotonic_ns
+
+
+EVENT_QUEUE_SIZE = 256
+
+InputEvent = namedtuple('InputEvent', ('timestamp', 'name', 'level'))
+TouchEvent = namedtuple('TouchEvent', ('timestamp', 'name', 'event'))
+AnalogEvent = namedtuple('AnalogEvent', ('timestamp', 'name', 'value'))
+
+_CLOSED = object()
+
+
+def _members(collection, members):
+    return list(members) if members else list(collection)
+
+
+def _listen(obj, listener):
+    """Add a listener to an input or pad, returning a function to remove it
+
+    The list is replaced rather than changed, as the thread
+    delivering events may be going through it."""
+    obj._listeners = obj._listeners + [listener]
+
+    def remove():
+        obj._listeners = [other for other in obj._listeners if other is not listener]
+
+    return remove
+
+
+class EventStream(object):
+    """Events from other threads, delivered into an event loop as an async iterator
+
+    Holds up to maxsize events for the loop to collect, any more
+    are dropped and counted in dropped. Close it to stop collecting,
+    iteration ends once the events held before it are collected."""
+    def __init__(self, maxsize=EVENT_QUEUE_SIZE):
+        self.loop = asyncio.get_event_loop()
+        self.dropped = 0
+        self._queue = asyncio.Queue(maxsize)
+        self._closers = []
+        self._closed = False
+
+    def push(self, event):
+        """Add an event, from any thread"""
+        if not self._closed:
+            self.loop.call_soon_threadsafe(self._put, event)
+
+    def _put(self, event):
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            for closer in self._closers:
+                closer()
+            self.loop.call_soon_threadsafe(self._end)
+
+    def _end(self):
+        # The end must always get in, so it takes the place of the oldest event if full
+        if self._queue.full():
+            self._queue.get_nowait()
+            self.dropped += 1
+        self._queue.put_nowait(_CLOSED)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        event = await self._queue.get()
+        if event is _CLOSED:
+            raise StopAsyncIteration
+        return event
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, type, value, traceback):
+        self.close()
+
+
+def input_events(*inputs, maxsize=EVENT_QUEUE_SIZE):
+    """Returns an EventStream of InputEvents from inputs, or from every input
+
+    Each event carries the time and level captured when the edge was seen."""
+    stream = EventStream(maxsize)
+
+    def listener(pin, timestamp, level):
+        stream.push(InputEvent(timestamp, pin.name, level))
+
+    for pin in _members(explorerhat.input, inputs):
+        pin._setup_callback()
+        stream._closers.append(_listen(pin, listener))
+
+    return stream
+
+
+def touch_events(*pads, maxsize=EVENT_QUEUE_SIZE):
+    """Returns an EventStream of TouchEvents from pads, or from every pad
+
+    event is "press", "release" or "held", as for touch handlers."""
+    stream = EventStream(maxsize)
+
+    def listener(pad, event):
+        stream.push(TouchEvent(monotonic_ns(), pad.name, event))
+
+    for pad in _members(explorerhat.touch, pads):
+        if not pad._setup_captouch():
+            raise RuntimeError("Touch is unavailable, check your pHAT/HAT and/or connections!")
+        stream._closers.append(_listen(pad, listener))
+
+    return stream
+
+
+def analog_events(*inputs, sensitivity=None, maxsize=EVENT_QUEUE_SIZE):
+    """Returns an EventStream of AnalogEvents from analog inputs, or from all four
+
+    Every sample is an event, or with a sensitivity only those that
+    differ from the last by more than it, in volts. Sampling is done
+    by the shared acquisition engine, see AnalogInput.sample_rate()."""
+    stream = EventStream(maxsize)
+
+    for analog in _members(explorerhat.analog, inputs):
+        engine = analog._engine()
+
+        def handler(channel, value, analog=analog):
+            stream.push(AnalogEvent(monotonic_ns(), analog.name, value))
+
+        if sensitivity is None:
+            engine.on_sample(analog.channel, handler)
+        else:
+            engine.on_change(analog.channel, handler, sensitivity)
+
+        stream._closers.append(lambda engine=engine, analog=analog, handler=handler:
+                               engine.unsubscribe(analog.channel, handler))
+
+    return stream
+
+
+def _when_done(animation):
+    """Returns a future completed once animation finishes or is stopped"""
+    loop = asyncio.get_event_loop()
+    future = loop.create_future()
+
+    def done(animation):
+        loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+    animation.add_done_callback(done)
+    if not animation.running:
+        done(animation)
+
+    return future
+
+
+async def fade(output, start, end, duration, shape='linear'):
+    """Fade an output or light, returning once the fade is over or interrupted"""
+    output.fade(start, end, duration, shape)
+    await _when_done(output.fader)
+
+
+async def pulse(output, transition_on=None, transition_off=None, time_on=None, time_off=None, shape='linear', cycles=1):
+    """Pulse an output or light for a number of cycles, returning when they're done or interrupted"""
+    times = explorerhat._pulse_times(transition_on, transition_off, time_on, time_off)
+    output.pulse(*times, shape=shape)
+
+    transition_on, transition_off, time_on, time_off = times
+    duration = (transition_on + time_on + transition_off + time_off) * cycles
+
+    # Without transitions the output blinks on PWM alone, with no animation to wait for
+    if transition_on == 0 and transition_off == 0:
+        await asyncio.sleep(duration)
+        output.stop()
+        return
+
+    done = _when_done(output.pulser)
+    try:
+        await asyncio.wait_for(asyncio.shield(done), duration)
+    except asyncio.TimeoutError:
+        output.stop_pulse()
+
+
+async def read(analog):
+    """Read an analog input, in volts, without blocking the loop"""
+    return await asyncio.get_event_loop().run_in_executor(None, analog.read)
+
+
+async def read_many(analog, n, rate=3300):
+    """Take n samples from an analog input, see AnalogInput.read_many, without blocking the loop"""
+    return await asyncio.get_event_loop().run_in_executor(None, analog.read_many, n, rate)
+
+
+def set_timeout(function, seconds):
+    """Call function after seconds, on the event loop, returning a handle to cancel it"""
+    return asyncio.get_event_loop().call_later(seconds, function)
+
+
+async def loop(callback, interval=0):
+    """Call callback, which may be a coroutine function, until explorerhat.stop()
+
+    With an interval, calls are that many seconds apart, timed from
+    the first, otherwise the loop just gets a turn between calls."""
+    explorerhat.running = True
+    deadline = monotonic_ns()
+
+    while explorerhat.running:
+        result = callback()
+        if asyncio.iscoroutine(result):
+            await result
+
+        # Skip ahead rather than running back to back to catch up
+        now = monotonic_ns()
+        deadline = max(deadline + int(interval * 1000000000), now)
+        await asyncio.sleep((deadline - now) / 1000000000.0)
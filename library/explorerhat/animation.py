@@ -0,0 +1,284 @@
+"""Shared animation scheduler
+
+One thread drives every running pulse and fade from a
+single deadline-ordered queue, rather than each output
+running its own thread.
+
+Animations falling due together are stepped as one frame,
+inside the context manager set by set_frame_batch(), so
+their output changes can be applied in one go.
+
+Times are integer nanoseconds from monotonic_ns(). Every
+frame's deadline is worked out from when its animation
+started, never from when the last frame ran, so late frames
+don't push the rest back and changes to the wall clock
+can't jump an animation's phase."""
+
+import heapq
+import itertools
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+
+from .pins import StoppableThread, monotonic_ns, print_exception
+
+
+NANOSECONDS = 1000000000
+
+# Upper bounds of the frame jitter histogram buckets, in microseconds
+JITTER_BUCKETS = (100, 500, 1000, 2000, 5000, 10000)
+
+_frame_batch = None
+
+
+def set_frame_batch(factory):
+    """Step each frame's animations inside the context manager returned by factory()"""
+    global _frame_batch
+    _frame_batch = factory
+
+
+def frame_at(time_start, now, fps):
+    """Return the number of the frame showing at now"""
+    return (now - time_start) * fps // NANOSECONDS
+
+
+def frame_deadline(time_start, frame, fps):
+    """Return the time frame is due, rounded up so frame_at() gives frame from then on"""
+    return time_start - (-frame * NANOSECONDS // fps)
+
+
+class FrameStats(object):
+    """How closely an Animation's frames kept to their deadlines
+
+    Jitter is how late a frame ran, and a frame that ran a whole
+    frame or more late is an overrun."""
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.fps = None
+        self.frames = 0
+        self.overruns = 0
+        self.jitter = [0] * (len(JITTER_BUCKETS) + 1)
+        self._jitter_total = 0
+        self._max_jitter = 0
+        self._first = None
+        self._last = None
+
+    def record(self, deadline, now, fps=None):
+        """Count a frame due at deadline that ran at now, for an animation aiming at fps"""
+        late = max(0, now - deadline)
+        self.fps = fps
+
+        self.frames += 1
+        self.jitter[bisect_left(JITTER_BUCKETS, late // 1000)] += 1
+        self._jitter_total += late
+        self._max_jitter = max(self._max_jitter, late)
+
+        if self.fps and late * self.fps >= NANOSECONDS:
+            self.overruns += 1
+
+        if self._first is None:
+            self._first = now
+        self._last = now
+
+    def as_dict(self):
+        """Frames run, their rate per second, overruns, and jitter in microseconds
+
+        Animations skip frames where nothing changes, so the frame
+        rate is only as high as the target while every frame differs."""
+        frames = self.frames
+        elapsed = (self._last - self._first) if frames > 1 else 0
+
+        labels = ['<{}us'.format(bound) for bound in JITTER_BUCKETS] + ['>={}us'.format(JITTER_BUCKETS[-1])]
+
+        return {
+            'frames': frames,
+            'target_fps': self.fps,
+            'fps': float(frames - 1) * NANOSECONDS / elapsed if elapsed else 0.0,
+            'overruns': self.overruns,
+            'mean_jitter': self._jitter_total / 1000.0 / frames if frames else 0.0,
+            'max_jitter': self._max_jitter / 1000.0,
+            'jitter': OrderedDict(zip(labels, self.jitter))
+        }
+
+
+class Animation(object):
+    """Base class for animations run by the Scheduler
+
+    Subclasses implement step(now), which updates the output and
+    returns the monotonic_ns() time of the next frame, or None
+    when finished. fps is the frame rate they aim for, if any."""
+    fps = None
+
+    def __init__(self):
+        self._generation = 0
+        self.scheduler = None
+        self.stats = FrameStats()
+        self._done_callbacks = []
+
+    @property
+    def running(self):
+        return self.scheduler is not None
+
+    def step(self, now):
+        raise NotImplementedError
+
+    def start(self, delay=0):
+        get_scheduler().add(self, monotonic_ns() + int(delay * NANOSECONDS))
+
+    def stop(self):
+        if self.scheduler is not None:
+            self.scheduler.remove(self)
+
+    def add_done_callback(self, callback):
+        """Call callback(animation) once, from the scheduler, when it next finishes or is stopped"""
+        self._done_callbacks.append(callback)
+
+    def _done(self):
+        callbacks, self._done_callbacks = self._done_callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+    def get_stats(self):
+        """Returns how closely frames have kept to time, see FrameStats.as_dict"""
+        return self.stats.as_dict()
+
+    def reset_stats(self):
+        self.stats.reset()
+
+
+class Scheduler(StoppableThread):
+    """Runs Animations from a deadline-ordered queue
+
+    Sleeps until the earliest deadline, or indefinitely
+    while there is nothing to animate."""
+    def __init__(self):
+        StoppableThread.__init__(self, 'explorerhat-animation')
+        self._cond = threading.Condition(threading.RLock())
+        self._queue = []
+        self._sequence = itertools.count()
+
+    @property
+    def lock(self):
+        """Held while animations are stepped, take it to change one between frames"""
+        return self._cond
+
+    def __len__(self):
+        with self._cond:
+            return sum(1 for entry in self._queue if entry[2] == entry[3]._generation)
+
+    def add(self, animation, deadline=None):
+        """Schedule an animation, replacing any pending frame"""
+        if deadline is None:
+            deadline = monotonic_ns()
+
+        with self._cond:
+            self._discard(animation)
+            animation._generation += 1
+            animation.scheduler = self
+            heapq.heappush(self._queue, (deadline, next(self._sequence), animation._generation, animation))
+            self._cond.notify()
+
+    def remove(self, animation):
+        """Unschedule an animation
+
+        Once this returns the animation will not be stepped again."""
+        with self._cond:
+            self._discard(animation)
+            # Also stops it being pushed back, should it be mid step
+            animation._generation += 1
+            animation.scheduler = None
+            # Wake now, rather than at the deadline it was waiting on
+            self._cond.notify()
+
+        animation._done()
+
+    def _discard(self, animation):
+        """Drop any queued frame of animation, so the thread doesn't wake for it"""
+        if animation.scheduler is self:
+            self._queue = [entry for entry in self._queue if entry[3] is not animation]
+            heapq.heapify(self._queue)
+
+    def stop(self):
+        if self.is_alive():
+            with self._cond:
+                self.stop_event.set()
+                self._cond.notify()
+            self.join()
+
+    def run(self):
+        with self._cond:
+            while not self.stop_event.is_set():
+                if not self._queue:
+                    self._cond.wait()
+                    self.wakeups += 1
+                    continue
+
+                deadline, _, generation, animation = self._queue[0]
+
+                if generation != animation._generation:
+                    heapq.heappop(self._queue)
+                    continue
+
+                now = monotonic_ns()
+                if deadline > now:
+                    self._cond.wait(float(deadline - now) / NANOSECONDS)
+                    self.wakeups += 1
+                    continue
+
+                if _frame_batch is None:
+                    self._step_due(now)
+                else:
+                    with _frame_batch():
+                        self._step_due(now)
+
+    def _step_due(self, now):
+        """Step every animation whose deadline has passed"""
+        due = []
+        while self._queue and self._queue[0][0] <= now:
+            due.append(heapq.heappop(self._queue))
+
+        for deadline, _, generation, animation in due:
+            if generation != animation._generation:
+                continue
+
+            animation.stats.record(deadline, now, animation.fps)
+
+            try:
+                deadline = animation.step(now)
+            except Exception:
+                print_exception()
+                deadline = None
+
+            if generation != animation._generation:
+                # Rescheduled or removed during its own step
+                continue
+
+            if deadline is None:
+                self.remove(animation)
+            else:
+                heapq.heappush(self._queue, (deadline, next(self._sequence), generation, animation))
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """Return the shared scheduler, creating it on first use"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = Scheduler()
+            _scheduler.start()
+        return _scheduler
+
+
+def stop_scheduler():
+    """Stop the shared scheduler thread and forget all animations"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is not None:
+            _scheduler.stop()
+            _scheduler = None
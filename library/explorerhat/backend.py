@@ -0,0 +1,674 @@
+"""Hardware backends for Explorer HAT
+
+A backend supplies the three things the library talks to: an RPi.GPIO
+compatible GPIO module, an SMBus compatible I2C bus and a Cap1208
+compatible touch controller. It may also offer the GPIO registers
+mapped into memory, for reading many pins at once.
+
+The "rpi" backend drives a real board. The "sim" backend keeps pin
+levels, an ADS1015 register file and a CAP1208 in memory so the library
+can be exercised on any machine. Pick one with the EXPLORERHAT_BACKEND
+environment variable or explorerhat.set_backend() before using any
+hardware."""
+
+import os
+import threading
+from sys import version_info
+
+from .gpiomem import GPLEV0
+from .pins import clock
+
+
+# RPi.GPIO compatible constants, so pins can be
+# declared before a backend has been chosen
+BCM = 11
+OUT = 0
+IN = 1
+LOW = 0
+HIGH = 1
+PUD_OFF = 20
+PUD_DOWN = 21
+PUD_UP = 22
+RISING = 31
+FALLING = 32
+BOTH = 33
+
+ADS1015_ADDRESS = 0x48
+CAP1208_ADDRESS = 0x28
+
+PWM_CHIP = '/sys/class/pwm/pwmchip0'
+
+
+def i2c_bus_id():
+    revision = ([l[12:-1] for l in open('/proc/cpuinfo', 'r').readlines() if l[:8] == "Revision"] + ['0000'])[0]
+    return 1 if int(revision, 16) >= 4 else 0
+
+
+def _mask_channels(mask):
+    """Return the GPIO numbers of the bits set in mask"""
+    channels = []
+    while mask:
+        lowest = mask & -mask
+        channels.append(lowest.bit_length() - 1)
+        mask ^= lowest
+    return channels
+
+
+class Backend(object):
+    """Base class for hardware backends"""
+    name = None
+
+    def gpio(self):
+        """Return an RPi.GPIO compatible module"""
+        raise NotImplementedError
+
+    def i2c_bus(self):
+        """Return an SMBus compatible bus"""
+        raise NotImplementedError
+
+    def cap1208(self, i2c=None):
+        """Return a Cap1208 compatible touch controller
+
+        Once probed, it should make its transfers through i2c if given."""
+        raise NotImplementedError
+
+    def gpio_mem(self):
+        """Return a gpiomem.GPIOMem, or None if the registers can't be mapped"""
+        return None
+
+    def pwm_chip(self):
+        """Return the sysfs directory of the SoC's PWM controller, or None if it has none"""
+        return None
+
+    def write_outputs(self, set_mask, clear_mask):
+        """Drive GPIO n high if bit n of set_mask is set, or low if bit n of clear_mask is
+
+        Backends should switch the pins together where they can,
+        by default the list form of GPIO.output() is used."""
+        channels = _mask_channels(set_mask | clear_mask)
+        if channels:
+            self.gpio().output(channels, [(set_mask >> channel) & 1 for channel in channels])
+
+
+class RPiBackend(Backend):
+    """Real hardware via RPi.GPIO, smbus and cap1xxx"""
+    name = 'rpi'
+
+    def __init__(self):
+        self._gpio = None
+        self._i2c = None
+        self._gpio_mem = None
+        self._gpio_mem_probed = False
+
+    def gpio(self):
+        if self._gpio is None:
+            try:
+                import RPi.GPIO as GPIO
+            except ImportError:
+                raise ImportError("This library requires the RPi.GPIO module\nInstall with: sudo pip install RPi.GPIO")
+            self._gpio = GPIO
+        return self._gpio
+
+    def i2c_bus(self):
+        if self._i2c is None:
+            try:
+                from smbus import SMBus
+            except ImportError:
+                if version_info[0] < 3:
+                    raise ImportError("This library requires python-smbus\nInstall with: sudo apt-get install python-smbus")
+                elif version_info[0] == 3:
+                    raise ImportError("This library requires python3-smbus\nInstall with: sudo apt-get install python3-smbus")
+            self._i2c = SMBus(i2c_bus_id())
+        return self._i2c
+
+    def cap1208(self, i2c=None):
+        try:
+            from cap1xxx import Cap1208
+        except ImportError:
+            raise ImportError("This library requires the cap1xxx module\nInstall with: sudo pip install cap1xxx")
+
+        cap1208 = Cap1208()
+
+        # cap1xxx opens its own SMBus, share ours instead and close its
+        if i2c is not None:
+            private, cap1208.i2c = cap1208.i2c, i2c
+            close = getattr(private, 'close', None)
+            if close is not None:
+                close()
+
+        return cap1208
+
+    def gpio_mem(self):
+        if not self._gpio_mem_probed:
+            self._gpio_mem_probed = True
+
+            from .gpiomem import GPIOMem
+
+            try:
+                self._gpio_mem = GPIOMem.open()
+            except EnvironmentError:
+                self._gpio_mem = None
+
+        return self._gpio_mem
+
+    def pwm_chip(self):
+        return PWM_CHIP if os.path.isdir(PWM_CHIP) else None
+
+    def write_outputs(self, set_mask, clear_mask):
+        mem = self.gpio_mem()
+        if mem is None:
+            Backend.write_outputs(self, set_mask, clear_mask)
+        else:
+            mem.write_outputs(set_mask, clear_mask)
+
+
+class SimulatedPWM(object):
+    """RPi.GPIO.PWM stand-in"""
+    def __init__(self, gpio, channel, frequency):
+        self.gpio = gpio
+        self.channel = channel
+        self.frequency = frequency
+        self.duty_cycle = 0
+        self.running = False
+
+    def start(self, duty_cycle):
+        self.running = True
+        self.ChangeDutyCycle(duty_cycle)
+
+    def stop(self):
+        self.running = False
+        self.gpio._set_level(self.channel, LOW)
+
+    def ChangeFrequency(self, frequency):
+        if frequency <= 0:
+            raise ValueError("frequency must be greater than 0.0")
+        self.frequency = frequency
+
+    def ChangeDutyCycle(self, duty_cycle):
+        if not 0 <= duty_cycle <= 100:
+            raise ValueError("dutycycle must have a value from 0.0 to 100.0")
+        self.duty_cycle = duty_cycle
+        if self.running:
+            self.gpio._set_level(self.channel, HIGH if duty_cycle > 0 else LOW)
+
+
+class SimulatedGPIO(object):
+    """RPi.GPIO stand-in that keeps pin levels in memory
+
+    Use set_input() to drive an input pin, edge callbacks
+    are run immediately in the calling thread."""
+    BCM = BCM
+    OUT = OUT
+    IN = IN
+    LOW = LOW
+    HIGH = HIGH
+    PUD_OFF = PUD_OFF
+    PUD_DOWN = PUD_DOWN
+    PUD_UP = PUD_UP
+    RISING = RISING
+    FALLING = FALLING
+    BOTH = BOTH
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.mode = None
+        self.directions = {}
+        self.levels = {}
+        self.callbacks = {}
+        self.mem = None
+
+    def attach_mem(self, mem):
+        """Mirror pin levels into the GPLEV0 register of a gpiomem.GPIOMem"""
+        with self._lock:
+            self.mem = mem
+            self._update_mem()
+
+    def _update_mem(self):
+        if self.mem is None:
+            return
+
+        bits = 0
+        for channel, level in self.levels.items():
+            if level and 0 <= channel < 32:
+                bits |= 1 << channel
+        self.mem.write_register(GPLEV0, bits)
+
+    def setmode(self, mode):
+        self.mode = mode
+
+    def setwarnings(self, flag):
+        pass
+
+    def setup(self, channel, direction, pull_up_down=PUD_OFF, initial=None):
+        with self._lock:
+            self.directions[channel] = direction
+            if direction == OUT:
+                self.levels[channel] = LOW if initial is None else initial
+            else:
+                self.levels.setdefault(channel, HIGH if pull_up_down == PUD_UP else LOW)
+            self._update_mem()
+
+    def input(self, channel):
+        return self.levels.get(channel, LOW)
+
+    def output_masks(self, set_mask, clear_mask):
+        """Change several outputs at once, see Backend.write_outputs()
+
+        Levels are updated together, edge callbacks run afterwards."""
+        changed = []
+        with self._lock:
+            for channel in _mask_channels(set_mask | clear_mask):
+                value = (set_mask >> channel) & 1
+                if self.levels.get(channel, LOW) != value:
+                    self.levels[channel] = value
+                    changed.append(channel)
+            if changed:
+                self._update_mem()
+
+        for channel in changed:
+            self._edge(channel, self.levels[channel])
+
+    def output(self, channel, value):
+        if isinstance(channel, (list, tuple)):
+            if not isinstance(value, (list, tuple)):
+                value = [value] * len(channel)
+            for c, v in zip(channel, value):
+                self._set_level(c, v)
+        else:
+            self._set_level(channel, value)
+
+    def add_event_detect(self, channel, edge, callback=None, bouncetime=None):
+        with self._lock:
+            if channel in self.callbacks:
+                raise RuntimeError("Conflicting edge detection already enabled for this GPIO channel")
+            self.callbacks[channel] = (edge, callback)
+
+    def remove_event_detect(self, channel):
+        with self._lock:
+            self.callbacks.pop(channel, None)
+
+    def cleanup(self, channel=None):
+        with self._lock:
+            if channel is None:
+                self.directions.clear()
+                self.callbacks.clear()
+            else:
+                self.directions.pop(channel, None)
+                self.callbacks.pop(channel, None)
+
+    def PWM(self, channel, frequency):
+        return SimulatedPWM(self, channel, frequency)
+
+    def set_input(self, channel, value):
+        """Drive a simulated input pin, firing any edge callback"""
+        self._set_level(channel, HIGH if value else LOW)
+
+    def _set_level(self, channel, value):
+        value = HIGH if value else LOW
+        with self._lock:
+            last = self.levels.get(channel, LOW)
+            self.levels[channel] = value
+            if value != last:
+                self._update_mem()
+
+        if value != last:
+            self._edge(channel, value)
+
+    def _edge(self, channel, value):
+        edge, callback = self.callbacks.get(channel, (None, None))
+
+        if not callable(callback):
+            return
+
+        if edge == BOTH or (edge == RISING and value == HIGH) or (edge == FALLING and value == LOW):
+            callback(channel)
+
+
+class SimulatedSMBus(object):
+    """SMBus stand-in that routes transfers to simulated devices by address"""
+    def __init__(self):
+        self.devices = {}
+
+    def attach(self, address, device):
+        self.devices[address] = device
+        return device
+
+    def _device(self, address):
+        try:
+            return self.devices[address]
+        except KeyError:
+            raise IOError(121, "Remote I/O error")
+
+    def read_byte_data(self, address, register):
+        return self._device(address).read(register, 1)[0]
+
+    def write_byte_data(self, address, register, value):
+        self._device(address).write(register, [value])
+
+    def read_i2c_block_data(self, address, register, length=32):
+        return self._device(address).read(register, length)
+
+    def write_i2c_block_data(self, address, register, data):
+        self._device(address).write(register, list(data))
+
+
+def _signed(value):
+    return value - 0x10000 if value & 0x8000 else value
+
+
+class SimulatedADS1015(object):
+    """ADS1015 register file
+
+    Set the voltage on each of the four single-ended inputs
+    with set_voltage(). Single-shot conversions take the time
+    set by the data rate, with OS reading 0 until complete,
+    continuous mode always reads the latest voltage.
+
+    The comparator is emulated, alert is called with the new
+    level of the ALERT/RDY pin whenever it changes."""
+    REG_CONV = 0x00
+    REG_CFG = 0x01
+    REG_LO_THRESH = 0x02
+    REG_HI_THRESH = 0x03
+
+    full_scale = {0x0000: 6.144, 0x0200: 4.096, 0x0400: 2.048, 0x0600: 1.024, 0x0800: 0.512, 0x0A00: 0.256}
+    data_rate = {0x0000: 128, 0x0020: 250, 0x0040: 490, 0x0060: 920, 0x0080: 1600, 0x00A0: 2400, 0x00C0: 3300, 0x00E0: 3300}
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.voltages = [0.0, 0.0, 0.0, 0.0]
+        self.registers = {
+            self.REG_CONV: 0x0000,
+            self.REG_CFG: 0x8583,
+            self.REG_LO_THRESH: 0x8000,
+            self.REG_HI_THRESH: 0x7FFF
+        }
+        self.alert = None
+        self.alert_level = HIGH
+        self._asserted = False
+        self._pending = None
+
+    def set_voltage(self, channel, voltage):
+        self.voltages[channel] = float(voltage)
+
+        with self._lock:
+            if not self.registers[self.REG_CFG] & 0x0100:
+                self.registers[self.REG_CONV] = self._convert(self.registers[self.REG_CFG])
+            level = self._compare()
+
+        self._set_alert(level)
+
+    def _compare(self):
+        """Run the comparator against the last conversion, returning the ALERT/RDY level"""
+        config = self.registers[self.REG_CFG]
+
+        if config & 0x0003 == 0x0003:
+            self._asserted = False
+        else:
+            code = _signed(self.registers[self.REG_CONV])
+            low = _signed(self.registers[self.REG_LO_THRESH])
+            high = _signed(self.registers[self.REG_HI_THRESH])
+
+            if config & 0x0010:
+                # Window comparator
+                asserted = code > high or code < low
+            else:
+                # Traditional comparator with hysteresis
+                asserted = code > high or (self._asserted and code >= low)
+
+            if not config & 0x0004 or asserted:
+                self._asserted = asserted
+
+        # COMP_POL selects active high, otherwise active low
+        return HIGH if self._asserted == bool(config & 0x0008) else LOW
+
+    def _set_alert(self, level):
+        if level == self.alert_level:
+            return
+
+        self.alert_level = level
+        if callable(self.alert):
+            self.alert(level)
+
+    def _convert(self, config):
+        mux = (config >> 12) & 0x07
+        full_scale = self.full_scale.get(config & 0x0E00, 0.256)
+
+        if mux < 4:
+            # Differential modes are not wired on Explorer HAT
+            return 0
+
+        code = int(round(self.voltages[mux - 4] / full_scale * 2048))
+        code = max(-2048, min(2047, code))
+        return (code << 4) & 0xFFFF
+
+    def _complete(self):
+        """Finish a pending single-shot conversion if its time is up"""
+        if self._pending is not None and clock() >= self._pending[0]:
+            self.registers[self.REG_CONV] = self._pending[1]
+            self._pending = None
+            return True
+        return False
+
+    def read(self, register, length):
+        register &= 0x03
+        level = None
+
+        with self._lock:
+            config = self.registers[self.REG_CFG]
+            if register == self.REG_CONV and not config & 0x0100:
+                # Continuous mode, always holds the latest conversion
+                self.registers[self.REG_CONV] = self._convert(config)
+            elif self._complete():
+                level = self._compare()
+
+            value = self.registers[register]
+            if register == self.REG_CFG and self._pending is not None:
+                # OS reads back as 0 while converting
+                value &= ~0x8000
+
+        if level is not None:
+            self._set_alert(level)
+
+        return ([(value >> 8) & 0xFF, value & 0xFF] * ((length + 1) // 2))[:length]
+
+    def write(self, register, data):
+        register &= 0x03
+        value = (data[0] << 8) | (data[1] if len(data) > 1 else 0)
+
+        with self._lock:
+            if register == self.REG_CFG:
+                if not value & 0x0100:
+                    self._pending = None
+                    self.registers[self.REG_CONV] = self._convert(value)
+                elif value & 0x8000:
+                    ready = clock() + 1.0 / self.data_rate[value & 0x00E0]
+                    self._pending = (ready, self._convert(value))
+                value |= 0x8000
+            self.registers[register] = value
+            level = self._compare()
+
+        self._set_alert(level)
+
+
+class SimulatedCap1208Registers(object):
+    """CAP1208 register file, just enough to identify the chip"""
+    R_PRODUCT_ID = 0xFD
+    R_MTOUCH_CONFIG = 0x2A
+
+    def __init__(self):
+        self.registers = {self.R_PRODUCT_ID: 0x6B, self.R_MTOUCH_CONFIG: 0x80}
+
+    def read(self, register, length):
+        return [self.registers.get(register + i, 0) for i in range(length)]
+
+    def write(self, register, data):
+        for i, value in enumerate(data):
+            self.registers[register + i] = value
+
+
+class SimulatedCap1208(object):
+    """Cap1208 stand-in
+
+    Use touch(), hold() and release() to fire pad events."""
+    def __init__(self, i2c, i2c_addr=CAP1208_ADDRESS):
+        self.i2c = i2c
+        self.i2c_addr = i2c_addr
+        self.handlers = {'press': {}, 'release': {}, 'held': {}}
+
+        # Probe like the real driver, raises IOError if nothing is attached
+        self.i2c.read_byte_data(self.i2c_addr, SimulatedCap1208Registers.R_PRODUCT_ID)
+
+    def on(self, channel=0, event='press', handler=None):
+        self.handlers[event][channel] = handler
+        return True
+
+    def enable_multitouch(self, en=True):
+        config = self.i2c.read_byte_data(self.i2c_addr, SimulatedCap1208Registers.R_MTOUCH_CONFIG)
+        if en:
+            config &= ~0x80
+        else:
+            config |= 0x80
+        self.i2c.write_byte_data(self.i2c_addr, SimulatedCap1208Registers.R_MTOUCH_CONFIG, config)
+
+    def _trigger(self, channel, event):
+        handler = self.handlers[event].get(channel)
+        if callable(handler):
+            handler(channel, event)
+
+    def touch(self, channel):
+        self._trigger(channel, 'press')
+
+    def hold(self, channel):
+        self._trigger(channel, 'held')
+
+    def release(self, channel):
+        self._trigger(channel, 'release')
+
+
+class SimulatedBackend(Backend):
+    """In-process Explorer HAT Pro
+
+    Exposes the simulated devices as gpio_device, bus,
+    ads1015 and cap1208_registers for driving tests.
+
+    Pass alert_pin to wire the ADS1015 ALERT/RDY output
+    to a GPIO, it is not connected on a real board.
+
+    Pin levels are mirrored into a file laid out like /dev/gpiomem,
+    gpiomem_path if given or otherwise a temporary file.
+
+    Pass a list of GPIOs as hardware_pwm to route them to hardware PWM,
+    as a pwm-2chan overlay would, backed by a temporary directory laid
+    out like a sysfs pwmchip."""
+    name = 'sim'
+
+    def __init__(self, analog=True, captouch=True, alert_pin=None, gpiomem_path=None, hardware_pwm=()):
+        self.gpio_device = SimulatedGPIO()
+        self.gpiomem_path = gpiomem_path
+        self.hardware_pwm = tuple(hardware_pwm)
+        self.pwm_chip_path = self._make_pwm_chip() if self.hardware_pwm else None
+        self._gpio_mem = None
+        self.bus = SimulatedSMBus()
+        self.ads1015 = None
+        self.cap1208_registers = None
+
+        if analog:
+            self.ads1015 = self.bus.attach(ADS1015_ADDRESS, SimulatedADS1015())
+
+            if alert_pin is not None:
+                self.gpio_device.levels[alert_pin] = self.ads1015.alert_level
+                self.ads1015.alert = lambda level: self.gpio_device._set_level(alert_pin, level)
+        if captouch:
+            self.cap1208_registers = self.bus.attach(CAP1208_ADDRESS, SimulatedCap1208Registers())
+
+        self._cap1208 = None
+
+    def gpio(self):
+        return self.gpio_device
+
+    def i2c_bus(self):
+        return self.bus
+
+    def cap1208(self, i2c=None):
+        if self._cap1208 is None:
+            self._cap1208 = SimulatedCap1208(self.bus if i2c is None else i2c)
+        return self._cap1208
+
+    def write_outputs(self, set_mask, clear_mask):
+        self.gpio_device.output_masks(set_mask, clear_mask)
+
+    def gpio_mem(self):
+        if self._gpio_mem is None:
+            from .gpiomem import GPIOMem, BLOCK_SIZE
+
+            if self.gpiomem_path is None:
+                import tempfile
+                file = tempfile.TemporaryFile()
+            else:
+                file = open(self.gpiomem_path, 'w+b')
+
+            file.truncate(BLOCK_SIZE)
+            self._gpio_mem = GPIOMem(file)
+            self.gpio_device.attach_mem(self._gpio_mem)
+
+            from .pwm import HARDWARE_PWM
+
+            for gpio in self.hardware_pwm:
+                self._gpio_mem.set_function(gpio, HARDWARE_PWM[gpio][1])
+
+        return self._gpio_mem
+
+    def pwm_chip(self):
+        return self.pwm_chip_path
+
+    def _make_pwm_chip(self):
+        import atexit
+        import shutil
+        import tempfile
+
+        path = tempfile.mkdtemp(prefix='explorerhat-pwmchip')
+
+        # Registered before setup_gpio() registers explorerhat_exit, so runs after it
+        atexit.register(shutil.rmtree, path, True)
+
+        for name, value in (('export', ''), ('unexport', ''), ('npwm', 2)):
+            with open(os.path.join(path, name), 'w') as f:
+                f.write(str(value))
+
+        for channel in range(2):
+            os.mkdir(os.path.join(path, 'pwm{}'.format(channel)))
+            for name in ('period', 'duty_cycle', 'enable'):
+                with open(os.path.join(path, 'pwm{}'.format(channel), name), 'w') as f:
+                    f.write('0')
+
+        return path
+
+
+BACKENDS = {
+    'rpi': RPiBackend,
+    'sim': SimulatedBackend
+}
+
+_backend = None
+
+
+def set_backend(backend):
+    """Select the active backend by name or instance"""
+    global _backend
+
+    if not isinstance(backend, Backend):
+        try:
+            backend = BACKENDS[backend]()
+        except KeyError:
+            raise ValueError("Unknown backend: {}, expected one of: {}".format(backend, ', '.join(sorted(BACKENDS))))
+
+    _backend = backend
+    return _backend
+
+
+def get_backend():
+    """Return the active backend, creating the default on first use"""
+    if _backend is None:
+        set_backend(os.environ.get('EXPLORERHAT_BACKEND', 'rpi'))
+    return _backend
@@ -0,0 +1,177 @@
+"""Software debounce for inputs
+
+Each debounced pin has a small state machine fed with the timestamped
+edges captured by its GPIO callback. It reports a new level only once
+the pin has stayed there for that direction's settle time, and always
+reports the level the pin settled at, unlike a bouncetime which only
+drops events.
+
+One thread checks every pin's pending change in a single pass, sleeping
+until the earliest is due to settle, or indefinitely while none are."""
+
+import threading
+
+from .pins import StoppableThread, monotonic_ns, print_exception
+
+
+NANOSECONDS_PER_MS = 1000000
+
+
+class PinDebouncer(object):
+    """Debounce state machine for one pin
+
+    Rests at a settled level until an edge to the other level, then
+    waits for the pin to stay there for that direction's settle time.
+    An edge back to the settled level before then is a glitch, and
+    is dropped. However many edges arrive it holds the same handful
+    of values, so memory use per pin is constant."""
+    __slots__ = ('handler', 'rise', 'fall', 'level', 'pending', 'since', 'edges', 'glitches', 'transitions')
+
+    def __init__(self, handler, level, rise, fall):
+        """@param handler Called with (timestamp, level) when the pin settles at a new level
+        @param level Level the pin is settled at to begin with
+        @param rise Nanoseconds a rising edge must hold to count
+        @param fall Nanoseconds a falling edge must hold to count"""
+        self.handler = handler
+        self.rise = rise
+        self.fall = fall
+        self.level = level
+        self.pending = None
+        self.since = 0
+        self.edges = 0
+        self.glitches = 0
+        self.transitions = 0
+
+    def deadline(self):
+        """Returns when the pending level will have settled, or None if nothing is pending"""
+        if self.pending is None:
+            return None
+        return self.since + (self.rise if self.pending else self.fall)
+
+    def edge(self, timestamp, level):
+        self.edges += 1
+
+        if level == self.level:
+            if self.pending is not None:
+                self.glitches += 1
+                self.pending = None
+        else:
+            # Timed from the latest edge, the pin may have bounced away and back
+            self.pending = level
+            self.since = timestamp
+
+    def settle(self):
+        """Take up the pending level, returning (timestamp of its edge, level)"""
+        self.level = self.pending
+        self.pending = None
+        self.transitions += 1
+        return self.since, self.level
+
+    def get_stats(self):
+        return {'edges': self.edges, 'glitches': self.glitches, 'transitions': self.transitions}
+
+
+class DebounceEngine(StoppableThread):
+    """Settles every PinDebouncer from one thread"""
+    def __init__(self):
+        StoppableThread.__init__(self, 'explorerhat-debounce')
+        self.pins = []
+        self._cond = threading.Condition()
+        self._next = None
+
+    def add(self, debouncer, level):
+        """Start settling debouncer from level, dropping anything it had pending"""
+        with self._cond:
+            debouncer.level = level
+            debouncer.pending = None
+            if debouncer not in self.pins:
+                self.pins.append(debouncer)
+
+    def remove(self, debouncer):
+        with self._cond:
+            self.pins = [pin for pin in self.pins if pin is not debouncer]
+
+    def configure(self, debouncer, rise, fall):
+        """Change settle times, taking effect for any change already pending"""
+        with self._cond:
+            debouncer.rise = rise
+            debouncer.fall = fall
+            self._cond.notify()
+
+    def edge(self, debouncer, timestamp, level):
+        """Feed an edge to debouncer, from the GPIO callback"""
+        with self._cond:
+            debouncer.edge(timestamp, level)
+
+            # Only wake the thread if this settles before whatever it is waiting for
+            deadline = debouncer.deadline()
+            if deadline is not None and (self._next is None or deadline < self._next):
+                self._next = deadline
+                self._cond.notify()
+
+    def stop(self):
+        if self.is_alive():
+            with self._cond:
+                self.stop_event.set()
+                self._cond.notify()
+            self.join()
+
+    def run(self):
+        with self._cond:
+            while not self.stop_event.is_set():
+                now = monotonic_ns()
+                settled = []
+                deadline = None
+
+                for debouncer in self.pins:
+                    due = debouncer.deadline()
+                    if due is None:
+                        continue
+                    if due <= now:
+                        settled.append((debouncer.handler, debouncer.settle()))
+                    elif deadline is None or due < deadline:
+                        deadline = due
+
+                if settled:
+                    self._cond.release()
+                    try:
+                        for handler, (timestamp, level) in settled:
+                            self._call(handler, timestamp, level)
+                    finally:
+                        self._cond.acquire()
+                    continue
+
+                self._next = deadline
+                if deadline is None:
+                    self._cond.wait()
+                else:
+                    self._cond.wait(float(deadline - now) / 1000000000)
+                self.wakeups += 1
+
+    def _call(self, handler, timestamp, level):
+        try:
+            handler(timestamp, level)
+        except Exception:
+            print_exception()
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_debounce_engine():
+    """Return the shared debounce engine, creating it on first use"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = DebounceEngine()
+            _engine.start()
+        return _engine
+
+
+def stop_debounce_engine():
+    global _engine
+    with _engine_lock:
+        if _engine is not None:
+            _engine.stop()
+            _engine = None
@@ -0,0 +1,258 @@
+"""Running input, touch and analog handlers
+
+By default handlers run inline, on whichever thread saw the event,
+so one slow handler holds up every event behind it. A Dispatcher can
+instead hand them to a bounded pool of threads, or through those to
+a pool of processes for handlers that need a CPU of their own.
+
+Events from one source, such as one input, are always handled one at
+a time and in the order they happened, whichever mode is used. Each
+source queues at most max_queue events, beyond which new ones are
+dropped and counted against their handler."""
+
+import threading
+import warnings
+from collections import deque
+
+from .pins import StoppableThread, monotonic_ns, print_exception
+
+
+INLINE = 'inline'
+THREAD = 'thread'
+PROCESS = 'process'
+
+MODES = (INLINE, THREAD, PROCESS)
+
+MAX_WORKERS = 4
+MAX_QUEUE = 64
+
+
+class HandlerStats(object):
+    """Calls, drops, queue depth and latency from event to call, for one handler"""
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.calls = 0
+        self.dropped = 0
+        self.queued = 0
+        self.max_queued = 0
+        self._latency_total = 0
+        self._max_latency = 0
+
+    def record(self, latency):
+        self.calls += 1
+        self._latency_total += latency
+        self._max_latency = max(self._max_latency, latency)
+
+    def as_dict(self):
+        """Counts, and mean and maximum latency in microseconds"""
+        return {
+            'calls': self.calls,
+            'dropped': self.dropped,
+            'queued': self.queued,
+            'max_queued': self.max_queued,
+            'mean_latency': self._latency_total / 1000.0 / self.calls if self.calls else 0.0,
+            'max_latency': self._max_latency / 1000.0
+        }
+
+
+class DispatchWorker(StoppableThread):
+    def __init__(self, dispatcher, number):
+        StoppableThread.__init__(self, 'explorerhat-dispatch-{}'.format(number))
+        self.dispatcher = dispatcher
+
+    def run(self):
+        self.dispatcher._work(self)
+
+
+class Dispatcher(object):
+    """Runs handlers inline, on a bounded thread pool or on a process pool
+
+    In process mode handlers, and everything passed to them, must
+    be picklable, so handlers need to be module level functions.
+    Any other handler is run on a thread instead."""
+    def __init__(self, mode=INLINE, workers=MAX_WORKERS, max_queue=MAX_QUEUE):
+        if mode not in MODES:
+            raise ValueError("Dispatch mode must be one of: {}".format(', '.join(MODES)))
+        if workers < 1 or max_queue < 1:
+            raise ValueError("Dispatch needs at least one worker and a queue of at least one")
+
+        self.mode = mode
+        self.workers = workers
+        self.max_queue = max_queue
+        self.stats = {}
+
+        self._cond = threading.Condition()
+        self._queues = {}
+        self._ready = deque()
+        self._busy = set()
+        self._threads = []
+        self._stopping = False
+        self._pool = None
+        self._portability = {}
+
+    def _stats(self, handler):
+        try:
+            return self.stats[handler]
+        except KeyError:
+            return self.stats.setdefault(handler, HandlerStats())
+
+    def dispatch(self, source, handler, *args):
+        """Call handler(*args) for an event from source"""
+        stats = self._stats(handler)
+        timestamp = monotonic_ns()
+
+        if self.mode == INLINE:
+            stats.record(0)
+            return handler(*args)
+
+        with self._cond:
+            if self._stopping:
+                return
+
+            queue = self._queues.get(source)
+            if queue is None:
+                queue = self._queues[source] = deque()
+
+            if len(queue) >= self.max_queue:
+                stats.dropped += 1
+                return
+
+            queue.append((handler, args, timestamp, stats))
+            stats.queued += 1
+            stats.max_queued = max(stats.max_queued, stats.queued)
+
+            # A source is ready or being handled by at most one worker, which keeps its events in order
+            if source not in self._busy:
+                self._busy.add(source)
+                self._ready.append(source)
+
+                if len(self._threads) < min(self.workers, len(self._busy)):
+                    worker = DispatchWorker(self, len(self._threads) + 1)
+                    self._threads.append(worker)
+                    worker.start()
+
+                self._cond.notify()
+
+    def _work(self, worker):
+        with self._cond:
+            while not worker.stop_event.is_set():
+                if not self._ready:
+                    self._cond.wait()
+                    worker.wakeups += 1
+                    continue
+
+                source = self._ready.popleft()
+                queue = self._queues[source]
+                handler, args, timestamp, stats = queue.popleft()
+                stats.queued -= 1
+                stats.record(monotonic_ns() - timestamp)
+
+                self._cond.release()
+                try:
+                    self._call(handler, args)
+                finally:
+                    self._cond.acquire()
+
+                if queue:
+                    self._ready.append(source)
+                else:
+                    self._busy.discard(source)
+                    del self._queues[source]
+
+    def _call(self, handler, args):
+        try:
+            if self.mode == PROCESS and self._portable(handler):
+                self._process_pool().apply(handler, args)
+            else:
+                handler(*args)
+        except Exception:
+            print_exception()
+
+    def _portable(self, handler):
+        """Check, once, that handler can be sent to another process, warning if it can't"""
+        portable = self._portability.get(handler)
+
+        if portable is None:
+            import pickle
+            try:
+                pickle.dumps(handler)
+                portable = True
+            except Exception:
+                warnings.warn("Handler {} can't be sent to another process, running it on a thread instead".format(
+                    getattr(handler, '__name__', handler)), RuntimeWarning)
+                portable = False
+            self._portability[handler] = portable
+
+        return portable
+
+    def _process_pool(self):
+        with self._cond:
+            if self._pool is None:
+                # Only loaded when asked for, multiprocessing is slow to import
+                import multiprocessing
+                self._pool = multiprocessing.Pool(self.workers)
+            return self._pool
+
+    def get_stats(self):
+        """Returns the stats of every handler, by handler name"""
+        result = {}
+        for handler, stats in list(self.stats.items()):
+            name = getattr(handler, '__name__', repr(handler))
+            while name in result:
+                name += "'"
+            result[name] = stats.as_dict()
+        return result
+
+    def reset_stats(self):
+        for stats in list(self.stats.values()):
+            stats.reset()
+
+    def stop(self):
+        """Stop the workers, dropping any events still queued"""
+        with self._cond:
+            self._stopping = True
+            for worker in self._threads:
+                worker.stop_event.set()
+            self._cond.notify_all()
+
+        for worker in self._threads:
+            if worker is not threading.current_thread():
+                worker.join()
+
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool = None
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher():
+    """Return the shared dispatcher, which runs handlers inline until configured"""
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = Dispatcher()
+        return _dispatcher
+
+
+def set_dispatcher(mode=INLINE, workers=MAX_WORKERS, max_queue=MAX_QUEUE):
+    """Replace the shared dispatcher, letting the old one finish what it is running"""
+    global _dispatcher
+    dispatcher = Dispatcher(mode, workers, max_queue)
+    with _dispatcher_lock:
+        old, _dispatcher = _dispatcher, dispatcher
+    if old is not None:
+        old.stop()
+    return dispatcher
+
+
+def stop_dispatcher():
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is not None:
+            _dispatcher.stop()
+            _dispatcher = None
@@ -0,0 +1,78 @@
+"""Timestamped input edges
+
+Each edge is recorded as (monotonic_ns timestamp, level) the moment
+its GPIO callback runs, into a bounded ring that is drained in
+batches. deque appends and pops are atomic, so the callback never
+waits on whoever is draining it, and a consumer that falls behind
+loses the oldest edges rather than blocking, with each one counted."""
+
+from collections import deque
+
+
+EDGE_BUFFER_SIZE = 256
+
+
+class EdgeStats(object):
+    """Edge counters for an EdgeBuffer
+
+    inferred counts edges that were never seen, but must have happened
+    because the pin was back at the level of the last edge when read."""
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.edges = 0
+        self.overflows = 0
+        self.inferred = 0
+
+    def as_dict(self):
+        return dict((name, value) for name, value in vars(self).items() if not name.startswith('_'))
+
+
+class EdgeBuffer(object):
+    """Bounded ring of (timestamp, level) edges, oldest first"""
+    def __init__(self, size=EDGE_BUFFER_SIZE):
+        if size < 1:
+            raise ValueError("Buffer size must be at least 1")
+
+        self.size = size
+        self.stats = EdgeStats()
+        self.level = None
+        self._edges = deque(maxlen=size)
+
+    def __len__(self):
+        return len(self._edges)
+
+    def push(self, timestamp, level):
+        """Record an edge to level, read at timestamp, from the GPIO callback"""
+        if level == self.level:
+            # Callbacks only come from edges, so the pin went the other
+            # way and back again before it could be read
+            self._append(timestamp, 1 - level)
+            self.stats.inferred += 1
+
+        self._append(timestamp, level)
+        self.level = level
+
+    def _append(self, timestamp, level):
+        if len(self._edges) == self.size:
+            self.stats.overflows += 1
+        self._edges.append((timestamp, level))
+        self.stats.edges += 1
+
+    def drain(self, max_edges=None):
+        """Remove and return up to max_edges edges, oldest first, or all of them"""
+        edges = self._edges
+        count = len(edges) if max_edges is None else min(max_edges, len(edges))
+        batch = []
+
+        try:
+            for _ in range(count):
+                batch.append(edges.popleft())
+        except IndexError:
+            pass
+
+        return batch
+
+    def clear(self):
+        self._edges.clear()
@@ -0,0 +1,104 @@
+"""Frequency and pulse width of an input, from its timestamped edges
+
+Edges are only recorded as they happen, see edges.EdgeBuffer, and are
+collected in batches when a measurement is asked for. Each batch is
+split into gates of a fixed length, and once a gate is over its edges
+are measured together:
+
+    frequency   - from the time between its first and last rising edge,
+                  rather than a count, so is accurate within one gate
+    pulse_width - mean time from each rising edge to the next falling edge
+    duty_cycle  - pulse_width as a percentage of the period
+
+EdgeBuffer always records edges alternating between high and low, so
+rising and falling edges are every other timestamp, and each gate is
+measured with slices and sums rather than by looking at every edge."""
+
+import threading
+from bisect import bisect_left
+from operator import itemgetter
+
+
+NANOSECONDS = 1000000000
+
+
+def _measure(edges):
+    """Returns (rising edges, time from first to last, total and count of pulse widths)"""
+    if not edges:
+        return 0, 0, 0, 0
+
+    timestamps = list(map(itemgetter(0), edges))
+    first = 0 if edges[0][1] else 1
+    rises = timestamps[first::2]
+    falls = timestamps[first + 1::2]
+
+    # Each rise is followed by a fall, apart from perhaps the last
+    widths = len(falls)
+    span = rises[-1] - rises[0] if rises else 0
+    return len(rises), span, sum(falls) - sum(rises[:widths]), widths
+
+
+class FrequencyCounter(object):
+    """Measures the edges from an EdgeBuffer in gates of a fixed length
+
+    The buffer must be big enough to hold the edges that arrive between
+    updates, if it overflows the oldest are lost, but as the rest are
+    still in order the gate they are in is measured correctly."""
+    def __init__(self, buffer, gate, start):
+        """@param buffer EdgeBuffer to take edges from, nothing else should drain it
+        @param gate Length of each gate in seconds
+        @param start monotonic_ns time the first gate starts"""
+        if gate <= 0:
+            raise ValueError("Gate time must be greater than 0")
+
+        self.buffer = buffer
+        self.gate = int(gate * NANOSECONDS)
+        self._start = start
+        self._pending = []
+        self._lock = threading.Lock()
+        self.result = self._result([], start)
+
+    def _result(self, edges, end):
+        rises, span, width_total, widths = _measure(edges)
+
+        if rises > 1:
+            frequency = (rises - 1) * float(NANOSECONDS) / span
+        else:
+            frequency = rises * float(NANOSECONDS) / self.gate
+
+        period = 1.0 / frequency if frequency else 0.0
+        pulse_width = float(width_total) / widths / NANOSECONDS if widths else 0.0
+
+        return {
+            'frequency': frequency,
+            'period': period,
+            'pulse_width': pulse_width,
+            'duty_cycle': min(100.0, pulse_width * 100.0 / period) if period else 0.0,
+            'edges': len(edges),
+            'time': end
+        }
+
+    def update(self, now):
+        """Collect new edges, measuring every gate that is over by now, and return the latest result"""
+        with self._lock:
+            pending = self._pending
+            pending.extend(self.buffer.drain())
+
+            while now >= self._start + self.gate:
+                end = self._start + self.gate
+
+                # Edges are in time order, (end,) sorts before any edge at end
+                split = bisect_left(pending, (end,))
+                self.result = self._result(pending[:split], end)
+                del pending[:split]
+                self._start = end
+
+                if not pending:
+                    # Any more whole gates were empty, so only the last needs measuring
+                    gates = (now - end) // self.gate
+                    if gates:
+                        self._start += gates * self.gate
+                        self.result = self._result([], self._start)
+                    break
+
+            return self.result
@@ -0,0 +1,75 @@
+"""Memory-mapped GPIO registers
+
+/dev/gpiomem maps the BCM283x GPIO register block without needing
+root. A single read of GPLEV0 returns the level of GPIO 0 to 31 at
+the same instant, instead of one GPIO.input() call per pin.
+
+Any file at least BLOCK_SIZE bytes long can stand in for the device,
+which is how the simulated backend presents the same layout."""
+
+import mmap
+import struct
+
+
+GPIOMEM_DEVICE = '/dev/gpiomem'
+BLOCK_SIZE = 4096
+
+# Function select registers, three bits per GPIO and ten GPIOs per register
+GPFSEL0 = 0x00
+
+# Pin functions
+FUNCTION_IN = 0b000
+FUNCTION_OUT = 0b001
+ALT0 = 0b100
+ALT5 = 0b010
+
+# Output set, output clear and pin level registers for GPIO 0 to 31
+GPSET0 = 0x1C
+GPCLR0 = 0x28
+GPLEV0 = 0x34
+
+
+class GPIOMem(object):
+    """GPIO register block mapped from an open file"""
+    def __init__(self, file):
+        self.file = file
+        self.mem = mmap.mmap(file.fileno(), BLOCK_SIZE)
+
+    @classmethod
+    def open(cls, path=GPIOMEM_DEVICE):
+        return cls(open(path, 'r+b'))
+
+    def read_register(self, offset):
+        return struct.unpack_from('<I', self.mem, offset)[0]
+
+    def write_register(self, offset, value):
+        struct.pack_into('<I', self.mem, offset, value & 0xFFFFFFFF)
+
+    def function(self, gpio):
+        """Return the function a GPIO is set to, such as FUNCTION_OUT or ALT0"""
+        register = self.read_register(GPFSEL0 + (gpio // 10) * 4)
+        return (register >> ((gpio % 10) * 3)) & 0b111
+
+    def set_function(self, gpio, function):
+        offset = GPFSEL0 + (gpio // 10) * 4
+        shift = (gpio % 10) * 3
+        register = self.read_register(offset) & ~(0b111 << shift)
+        self.write_register(offset, register | (function << shift))
+
+    def levels(self):
+        """Return the levels of GPIO 0 to 31 as a bitmask, bit n is GPIO n"""
+        return struct.unpack_from('<I', self.mem, GPLEV0)[0]
+
+    def write_outputs(self, set_mask, clear_mask):
+        """Drive the outputs in set_mask high and those in clear_mask low
+
+        Each mask is applied by one register write, so all of the pins
+        going high switch together, followed by all of those going low."""
+        if set_mask:
+            struct.pack_into('<I', self.mem, GPSET0, set_mask)
+        if clear_mask:
+            struct.pack_into('<I', self.mem, GPCLR0, clear_mask)
+
+    def close(self):
+        self.mem.close()
+        self.file.close()
@@ -0,0 +1,247 @@
+"""Shared I2C bus manager
+
+The ADC and touch drivers share one physical bus. I2CBus wraps an
+SMBus compatible bus so every transfer is serialised by one lock,
+counted and timed. batch() holds the bus for a sequence of transfers,
+each still a transaction of its own, as neither device takes a block
+write across the registers written here."""
+
+import threading
+
+from .pins import clock
+
+
+class I2CStats(object):
+    """Transaction, byte and lock contention counters for an I2CBus"""
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.transactions = 0
+        self.reads = 0
+        self.writes = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.errors = 0
+        self.elided_writes = 0
+        self.lock_acquisitions = 0
+        self.lock_contentions = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    def as_dict(self):
+        return dict((name, value) for name, value in vars(self).items() if not name.startswith('_'))
+
+
+class I2CBus(object):
+    """Serialised, instrumented access to an SMBus compatible bus"""
+    def __init__(self, i2c):
+        self.i2c = i2c
+        self.stats = I2CStats()
+        self._lock = threading.RLock()
+
+    def acquire(self):
+        """Take the bus, recording how long we waited if it was busy"""
+        stats = self.stats
+
+        if self._lock.acquire(False):
+            stats.lock_acquisitions += 1
+            return
+
+        start = clock()
+        self._lock.acquire()
+        wait = clock() - start
+
+        stats.lock_acquisitions += 1
+        stats.lock_contentions += 1
+        stats.wait_time += wait
+        stats.max_wait_time = max(stats.max_wait_time, wait)
+
+    def release(self):
+        self._lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.release()
+
+    def _transfer(self, function, *args):
+        self.stats.transactions += 1
+        try:
+            return function(*args)
+        except IOError:
+            self.stats.errors += 1
+            raise
+
+    def read_byte_data(self, address, register):
+        with self:
+            value = self._transfer(self.i2c.read_byte_data, address, register)
+            self.stats.reads += 1
+            self.stats.bytes_read += 1
+        return value
+
+    def write_byte_data(self, address, register, value):
+        with self:
+            self._transfer(self.i2c.write_byte_data, address, register, value)
+            self.stats.writes += 1
+            self.stats.bytes_written += 1
+
+    def read_i2c_block_data(self, address, register, length=32):
+        with self:
+            data = self._transfer(self.i2c.read_i2c_block_data, address, register, length)
+            self.stats.reads += 1
+            self.stats.bytes_read += len(data)
+        return data
+
+    def write_i2c_block_data(self, address, register, data):
+        with self:
+            self._transfer(self.i2c.write_i2c_block_data, address, register, data)
+            self.stats.writes += 1
+            self.stats.bytes_written += len(data)
+
+    def batch(self):
+        """Hold the bus for a sequence of transfers
+
+        Use as a context manager with the same methods as the bus.
+        Writes are queued and sent in order when it exits, or before
+        the next read, so nothing else gets onto the bus in between."""
+        return I2CBatch(self)
+
+    def get_stats(self):
+        return self.stats.as_dict()
+
+    def reset_stats(self):
+        self.stats.reset()
+
+
+class I2CBatch(object):
+    """A sequence of transfers made while holding an I2CBus, see I2CBus.batch()"""
+    def __init__(self, bus):
+        self.bus = bus
+        self._pending = []
+
+    def __enter__(self):
+        self.bus.acquire()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        try:
+            if type is None:
+                self.flush()
+        finally:
+            self._pending = []
+            self.bus.release()
+
+    def _queue(self, address, register, data):
+        self._pending.append((address, register, list(data)))
+
+    def flush(self):
+        """Send any queued writes"""
+        pending, self._pending = self._pending, []
+        for address, register, data in pending:
+            if len(data) == 1:
+                self.bus.write_byte_data(address, register, data[0])
+            else:
+                self.bus.write_i2c_block_data(address, register, data)
+
+    def write_byte_data(self, address, register, value):
+        self._queue(address, register, [value])
+
+    def write_i2c_block_data(self, address, register, data):
+        self._queue(address, register, data)
+
+    def read_byte_data(self, address, register):
+        self.flush()
+        return self.bus.read_byte_data(address, register)
+
+    def read_i2c_block_data(self, address, register, length=32):
+        self.flush()
+        return self.bus.read_i2c_block_data(address, register, length)
+
+
+class ShadowBatch(I2CBatch):
+    """An I2CBatch for a RegisterShadow, see RegisterShadow.batch()"""
+    def __init__(self, shadow):
+        I2CBatch.__init__(self, shadow.bus)
+        self.shadow = shadow
+
+    def __exit__(self, type, value, traceback):
+        # Which queued writes reached the device isn't known, so forget them all
+        try:
+            I2CBatch.__exit__(self, type, value, traceback)
+        except Exception:
+            self.shadow.invalidate()
+            raise
+
+        if type is not None:
+            self.shadow.invalidate()
+
+
+class RegisterShadow(object):
+    """Remembers the last value written to each register of one device
+
+    Writes of a value the register already holds are skipped, and
+    counted in elided. Only use for registers the device never changes
+    by itself, and invalidate() after anything that resets it."""
+    def __init__(self, bus, address):
+        self.bus = bus
+        self.address = address
+        self.values = {}
+        self.writes = 0
+        self.elided = 0
+
+    def elide(self):
+        """Count a write that was avoided"""
+        self.elided += 1
+        self.bus.stats.elided_writes += 1
+
+    def _written(self, register, value, force):
+        if not force and self.values.get(register) == value:
+            self.elide()
+            return True
+        return False
+
+    def batch(self):
+        """Hold the bus for a sequence of reads and writes, see I2CBus.batch()
+
+        Pass the batch as bus to the other methods to queue writes in
+        it. If the batch fails every shadowed value is forgotten."""
+        return ShadowBatch(self)
+
+    def write_byte(self, register, value, force=False, bus=None):
+        if self._written(register, value, force):
+            return False
+
+        self.values.pop(register, None)
+        (bus or self.bus).write_byte_data(self.address, register, value)
+        self.values[register] = value
+        self.writes += 1
+        return True
+
+    def write_word(self, register, value, force=False, bus=None):
+        """Write a big-endian 16-bit register, returns False if the write was skipped"""
+        if self._written(register, value, force):
+            return False
+
+        self.values.pop(register, None)
+        (bus or self.bus).write_i2c_block_data(self.address, register, [(value >> 8) & 0xFF, value & 0xFF])
+        self.values[register] = value
+        self.writes += 1
+        return True
+
+    def read_byte(self, register, bus=None):
+        """Return the shadowed value of a register, reading it from the device only once"""
+        if register not in self.values:
+            self.values[register] = (bus or self.bus).read_byte_data(self.address, register)
+        return self.values[register]
+
+    def invalidate(self, register=None):
+        if register is None:
+            self.values.clear()
+        else:
+            self.values.pop(register, None)
+
+    def get_stats(self):
+        return {'writes': self.writes, 'elided': self.elided}
@@ -1,43 +1,130 @@
 import threading
+import time
+import weakref
+
+
+# Immune to wall-clock jumps where available
+clock = getattr(time, 'monotonic', time.time)
+
+try:
+    monotonic_ns = time.monotonic_ns
+except AttributeError:
+    def monotonic_ns():
+        return int(clock() * 1000000000)
+
+
+def print_exception():
+    """Print the exception being handled, for errors in background threads
+
+    traceback is slow to import, so it is only loaded when needed."""
+    import traceback
+    traceback.print_exc()
 
 
 class StoppableThread(threading.Thread):
     """Basic Stoppable Thread Wrapper
 
     Adds event for stopping the execution
-    loop and exiting cleanly."""
-    def __init__(self):
+    loop and exiting cleanly.
+
+    Subclasses count each time their loop wakes in wakeups,
+    and should block outright while they have nothing to do."""
+    def __init__(self, name=None):
         threading.Thread.__init__(self)
         self.stop_event = threading.Event()
         self.daemon = True
+        self.wakeups = 0
+        if name is not None:
+            self.name = name
+        _threads.add(self)
 
     def start(self):
-        if not self.isAlive():
+        if not self.is_alive():
             self.stop_event.clear()
             threading.Thread.start(self)
 
     def stop(self):
-        if self.isAlive():
+        if self.is_alive():
             self.stop_event.set()
             self.join()
 
 
+_threads = weakref.WeakSet()
+
+
+def get_wakeups():
+    """Return the wakeups of each running StoppableThread, by thread name"""
+    return dict((thread.name, thread.wakeups) for thread in list(_threads) if thread.is_alive())
+
+
 class AsyncWorker(StoppableThread):
     """Basic thread wrapper class for asynchronously running functions
 
-    Return False from the worker function to abort loop."""
-    def __init__(self, todo):
-        StoppableThread.__init__(self)
+    Return False from the worker function to abort loop.
+
+    With an interval the function is called every interval seconds,
+    timed from when the worker started, rather than back to back.
+    A paused worker blocks until resumed or stopped."""
+    def __init__(self, todo, interval=None, name=None):
+        StoppableThread.__init__(self, name)
         self.todo = todo
+        self.interval = interval
+        self._cond = threading.Condition()
+        self._paused = False
+
+    def pause(self):
+        with self._cond:
+            self._paused = True
+            self._cond.notify()
+
+    def resume(self):
+        with self._cond:
+            self._paused = False
+            self._cond.notify()
+
+    def stop(self):
+        if self.is_alive():
+            with self._cond:
+                self.stop_event.set()
+                self._cond.notify()
+            self.join()
+
+    def _wait(self, deadline):
+        """Block while paused, or until deadline, returning False once stopped"""
+        with self._cond:
+            while not self.stop_event.is_set():
+                if self._paused:
+                    self._cond.wait()
+                    self.wakeups += 1
+                    continue
+
+                delay = deadline - clock() if deadline is not None else 0
+                if delay <= 0:
+                    return True
+
+                self._cond.wait(delay)
+                self.wakeups += 1
+
+        return False
 
     def run(self):
-        while not self.stop_event.is_set():
+        deadline = clock() if self.interval is not None else None
+
+        while self._wait(deadline):
+            if deadline is None:
+                # Nothing to wait for, so each call is a pass of the loop
+                self.wakeups += 1
+
             # Explicitly check for False being returned
             # from worker, IE: Don't allow None
             if self.todo() is False:
                 self.stop_event.set()
                 break
 
+            if deadline is not None:
+                # Skip ahead rather than running back to back to catch up
+                deadline = max(deadline + self.interval, clock())
+
 
 class ObjectCollection:
     """Represents a collection of similar objects
@@ -45,46 +132,55 @@ class ObjectCollection:
     Allows multiple named attributes to be
     added to produce a tidy API. Methods can then
     be called against one or all of the collections members.
+
+    Members added with _add_lazy are only created
+    when they are first used.
     """
 
     def __init__(self, **kwargs):
         self._all = {}
+        self._factories = {}
         self._aliases = {}
         self._index = []
+        self._lock = threading.Lock()
         for name in kwargs:
                 self._add_single(name, kwargs[name])
 
     def __iter__(self):
         for pin in self._index:
-            yield self._all[pin]
+            yield self._get(pin)
 
     def __call__(self):
         return self
 
     def __repr__(self):
         """Allows collection to return a list of members"""
-        return str(', '.join(self._all.keys()))
+        return str(', '.join(self._index))
 
     def __str__(self):
-        return ', '.join(self._all.keys())
+        return ', '.join(self._index)
 
     def __len__(self):
         return len(self._index)
 
     def __dir__(self):
         """Returns all items in the collection"""
-        return self._all.keys() + dir(self._all[self._all.keys()[0]])
+        return list(self._index) + dir(self._get(self._index[0]))
 
     def __getattr__(self, name):
         """Returns a pin if found by name
 
         Otherwise runs named function against all pins"""
 
+        # Avoid recursing for attributes looked up before __init__ completes
+        if name.startswith('__') or name in ('_all', '_factories', '_aliases', '_index', '_lock'):
+            raise AttributeError(name)
+
         # Return the pin if we have it
-        if name in self._all.keys():
-            return self._all[name]
-        if name in self._aliases.keys():
-            return self._aliases[name]
+        if name in self._all or name in self._factories:
+            return self._get(name)
+        if name in self._aliases:
+            return self._get(self._aliases[name])
 
         # Otherwise try to run against all pins
         else:
@@ -96,9 +192,29 @@ class ObjectCollection:
     def __getitem__(self, key):
         """Supprot accessing with [n]"""
         if isinstance(key, int):
-            return self._all[self._index[key]]
+            return self._get(self._index[key])
         else:
-            return self._all[key]
+            return self._get(key)
+
+    def _get(self, name):
+        """Return a member by name, creating it if it was added lazily"""
+        try:
+            return self._all[name]
+        except KeyError:
+            pass
+
+        with self._lock:
+            if name not in self._all:
+                obj = self._factories.pop(name)()
+                obj.name = name
+                self._all[name] = obj
+            return self._all[name]
+
+    def _instances(self):
+        """Iterate through the members that have been created so far"""
+        for name in self._index:
+            if name in self._all:
+                yield self._all[name]
 
     def _do(self, name, *args, **kwargs):
         """Runs a function against all registered pins
@@ -106,7 +222,7 @@ class ObjectCollection:
         Ask for a specific method to be run against all added pins"""
         _results = {}
         for node in self._index:
-            handler = getattr(self._all[node], name)
+            handler = getattr(self._get(node), name)
             if hasattr(handler, '__call__'):
                 _results[node] = handler(*args, **kwargs)
             else:
@@ -124,8 +240,14 @@ class ObjectCollection:
         for name in kwargs:
             self._add_single(name, kwargs[name])
 
+    def _add_lazy(self, **kwargs):
+        """Add members by factory, each is called to create its member on first use"""
+        for name in kwargs:
+            self._factories[name] = kwargs[name]
+            self._index.append(name)
+
     def _add_alias(self, name, target):
-        self._aliases[name] = self._all[target]
+        self._aliases[name] = target
 
     def _add_single(self, name, obj):
         """Add a single item to the collection"""
@@ -133,9 +255,13 @@ class ObjectCollection:
         self._all[name].name = name
         self._index.append(name)
 
+    def play(self, timeline, loop=False):
+        """Play a Timeline, looking up its named targets in this collection"""
+        return timeline.play(self, loop=loop)
+
     def each(self, handler):
         """Iterate through each item in the collection
         and pass them to "handler" function in turn as
         the sole argument."""
-        for name in self._all.keys():
-            handler(self._all[name])
+        for name in self._index:
+            handler(self._get(name))
@@ -0,0 +1,517 @@
+"""PWM engine for outputs, lights and motors
+
+GPIO 12, 13, 18 and 19 can be driven by the SoC's two hardware PWM
+channels, through sysfs, when an overlay such as pwm-2chan routes them
+there. Every other pin shares one software PWM thread, which schedules
+the edges of all of its channels and applies those falling due
+together as a single set and clear mask, instead of busy-looping a
+thread per pin.
+
+Channels have the same interface as RPi.GPIO.PWM."""
+
+import os
+import threading
+import time
+
+from .gpiomem import ALT0, ALT5
+from .pins import StoppableThread, clock
+
+
+# GPIO: (hardware PWM channel, pin function that routes the channel to it)
+# GPIO 12 and 18 share channel 0, GPIO 13 and 19 share channel 1
+HARDWARE_PWM = {
+    12: (0, ALT0),
+    13: (1, ALT0),
+    18: (0, ALT5),
+    19: (1, ALT5)
+}
+
+# Soft PWM edges due within this many seconds of each other are applied together
+MERGE_WINDOW = 0.0001
+
+# Python can't usefully time edges much faster than this, and it is
+# plenty for dimming LEDs, so soft PWM runs no faster
+MAX_SOFT_FREQUENCY = 200
+
+# How long to wait for udev to make a newly exported channel writable
+EXPORT_TIMEOUT = 1.0
+
+
+def _check_duty_cycle(duty_cycle):
+    if not 0 <= duty_cycle <= 100:
+        raise ValueError("dutycycle must have a value from 0.0 to 100.0")
+
+
+def _check_frequency(frequency):
+    if frequency <= 0:
+        raise ValueError("frequency must be greater than 0.0")
+
+
+class PWMChannel(object):
+    """RPi.GPIO.PWM compatible channel handed out by a PWMEngine
+
+    Remembers the duty cycle and frequency it last applied and skips
+    changes to the same value. Changes made inside PWMEngine.batch()
+    are held back and applied together when the batch ends."""
+    hardware = False
+
+    def __init__(self, engine, gpio, frequency):
+        _check_frequency(frequency)
+        self.engine = engine
+        self.gpio = gpio
+        self.frequency = frequency
+        self.duty_cycle = 0
+        self.running = False
+
+    def start(self, duty_cycle):
+        _check_duty_cycle(duty_cycle)
+        self.engine.start(self, duty_cycle)
+
+    def stop(self):
+        self.engine.stop_channel(self)
+
+    def release(self):
+        """Stop, leaving the pin at whatever level it is at for it to be driven directly"""
+        self.engine.release_channel(self)
+
+    def ChangeFrequency(self, frequency):
+        _check_frequency(frequency)
+        self.engine.change(self, frequency=frequency)
+
+    def ChangeDutyCycle(self, duty_cycle):
+        _check_duty_cycle(duty_cycle)
+        self.engine.change(self, duty_cycle=duty_cycle)
+
+    def _start(self):
+        raise NotImplementedError
+
+    def _stop(self):
+        raise NotImplementedError
+
+    def _release(self):
+        self._stop()
+
+    def _apply(self, frequency_changed):
+        """Put the current duty_cycle, and frequency if it changed, into effect"""
+        raise NotImplementedError
+
+
+class HardwarePWM(PWMChannel):
+    """One SoC PWM channel, driven through its sysfs pwmchip directory"""
+    hardware = True
+
+    def __init__(self, engine, gpio, frequency, chip, channel):
+        PWMChannel.__init__(self, engine, gpio, frequency)
+        self.chip = chip
+        self.channel = channel
+        self.path = os.path.join(chip, 'pwm{}'.format(channel))
+
+        if not os.path.isdir(self.path):
+            self._write(os.path.join(chip, 'export'), channel)
+
+        deadline = clock() + EXPORT_TIMEOUT
+        while not os.access(os.path.join(self.path, 'enable'), os.W_OK):
+            if clock() > deadline:
+                raise IOError("Timed out exporting PWM channel {}".format(channel))
+            time.sleep(0.01)
+
+    @staticmethod
+    def _write(path, value):
+        with open(path, 'w') as f:
+            f.write(str(value))
+
+    def _set(self, name, value):
+        self._write(os.path.join(self.path, name), value)
+
+    @property
+    def period(self):
+        """Period in nanoseconds"""
+        return int(1000000000 / self.frequency)
+
+    def _set_period(self):
+        # The duty cycle may never exceed the period, so clear it first
+        self._set('duty_cycle', 0)
+        self._set('period', self.period)
+        self._set('duty_cycle', int(self.period * self.duty_cycle / 100.0))
+
+    def _start(self):
+        self._set_period()
+        self._set('enable', 1)
+
+    def _stop(self):
+        self._set('enable', 0)
+
+    def _apply(self, frequency_changed):
+        if frequency_changed:
+            self._set_period()
+        else:
+            self._set('duty_cycle', int(self.period * self.duty_cycle / 100.0))
+
+    def close(self):
+        """Stop and hand the channel back to the kernel"""
+        self.stop()
+        self._write(os.path.join(self.chip, 'unexport'), self.channel)
+
+
+class SoftPWMChannel(PWMChannel):
+    """A pin driven by the shared SoftPWM thread"""
+
+    def __init__(self, engine, gpio, frequency):
+        PWMChannel.__init__(self, engine, gpio, frequency)
+
+        # Edge state, only touched by the SoftPWM thread
+        self.high = False
+        self.period_start = None
+        self.next_edge = None
+
+    @property
+    def period(self):
+        return 1.0 / min(self.frequency, MAX_SOFT_FREQUENCY)
+
+    @property
+    def on_time(self):
+        return self.period * self.duty_cycle / 100.0
+
+    def _apply(self, frequency_changed=False):
+        self.engine.soft.update([self])
+
+    def _release(self):
+        self.engine.soft.release(self)
+
+    _start = _stop = _apply
+
+
+class SoftPWM(StoppableThread):
+    """Drives any number of SoftPWMChannels from one thread
+
+    Channels at 0% or 100% are simply set low or high and cost nothing
+    until they change. The rest have their periods aligned, so those at
+    the same frequency rise together, and every edge due within
+    MERGE_WINDOW is applied by one write_outputs(set_mask, clear_mask)
+    call. The thread sleeps indefinitely while no channel is toggling."""
+    def __init__(self, write_outputs):
+        StoppableThread.__init__(self, 'explorerhat-pwm')
+        self.write_outputs = write_outputs
+        self.channels = set()
+        self.epoch = clock()
+        self.writes = 0
+        self._cond = threading.Condition()
+
+    def update(self, channels):
+        """Put the running state, duty cycle and frequency of each channel into effect"""
+        set_mask = clear_mask = 0
+
+        with self._cond:
+            for channel in channels:
+                if not channel.running or channel.duty_cycle in (0, 100):
+                    self.channels.discard(channel)
+                    channel.high = channel.running and channel.duty_cycle == 100
+                    channel.next_edge = None
+                    if channel.high:
+                        set_mask |= 1 << channel.gpio
+                    else:
+                        clear_mask |= 1 << channel.gpio
+                    continue
+
+                if channel not in self.channels:
+                    # Align to the shared grid, so channels at one frequency rise together
+                    now = clock()
+                    periods = int((now - self.epoch) / channel.period) + 1
+                    channel.period_start = self.epoch + (periods - 1) * channel.period
+                    self.channels.add(channel)
+
+                # Retime the pending edge, one in the past is applied straight away
+                if channel.high:
+                    channel.next_edge = channel.period_start + channel.on_time
+                else:
+                    channel.next_edge = channel.period_start + channel.period
+
+            if set_mask or clear_mask:
+                self.write_outputs(set_mask, clear_mask)
+                self.writes += 1
+
+            self._cond.notify()
+
+    def release(self, channel):
+        """Stop toggling channel without writing its pin"""
+        with self._cond:
+            self.channels.discard(channel)
+            channel.high = False
+            channel.next_edge = None
+            self._cond.notify()
+
+    def stop(self):
+        if self.is_alive():
+            with self._cond:
+                self.stop_event.set()
+                self._cond.notify()
+            self.join()
+
+    def get_stats(self):
+        return {'soft_channels': len(self.channels), 'wakeups': self.wakeups, 'writes': self.writes}
+
+    def run(self):
+        with self._cond:
+            while not self.stop_event.is_set():
+                if not self.channels:
+                    self._cond.wait()
+                    self.wakeups += 1
+                    continue
+
+                now = clock()
+                due = min(channel.next_edge for channel in self.channels)
+
+                if due - now > MERGE_WINDOW:
+                    self._cond.wait(due - now)
+                    self.wakeups += 1
+                    continue
+
+                horizon = now + MERGE_WINDOW
+                set_mask = clear_mask = 0
+
+                for channel in self.channels:
+                    if channel.next_edge > horizon:
+                        continue
+
+                    if channel.high:
+                        clear_mask |= 1 << channel.gpio
+                        channel.high = False
+                        channel.next_edge = channel.period_start + channel.period
+                    else:
+                        # Start the next period, skipping any we have fallen behind on
+                        period_start = channel.next_edge
+                        if now - period_start > channel.period:
+                            period_start = now
+                        set_mask |= 1 << channel.gpio
+                        channel.high = True
+                        channel.period_start = period_start
+                        channel.next_edge = period_start + channel.on_time
+
+                self.write_outputs(set_mask, clear_mask)
+                self.writes += 1
+
+
+class PWMStats(object):
+    """Counts duty cycle and frequency changes applied, and those skipped as redundant"""
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.duty_applied = 0
+        self.duty_suppressed = 0
+        self.frequency_applied = 0
+        self.frequency_suppressed = 0
+        # Batches that applied at least one change
+        self.batches = 0
+
+    def as_dict(self):
+        return dict((name, value) for name, value in vars(self).items() if not name.startswith('_'))
+
+
+class PWMBatch(object):
+    """Changes held back by PWMEngine.batch(), see there"""
+    def __init__(self, engine):
+        self.engine = engine
+        self.pending = None
+
+    def __enter__(self):
+        local = self.engine._local
+        if getattr(local, 'pending', None) is None:
+            self.pending = local.pending = {}
+        return self
+
+    def __exit__(self, type, value, traceback):
+        if self.pending is not None:
+            self.engine._local.pending = None
+            self.engine._flush(self.pending, batch=True)
+            self.pending = None
+
+
+class PWMEngine(object):
+    """Hands out a PWM channel for each pin, using hardware PWM where it can
+
+    A pin gets hardware PWM if the backend has a pwmchip, the pin is
+    routed to a PWM channel and no other pin has claimed that channel."""
+    def __init__(self, backend):
+        self.backend = backend
+        self.soft = SoftPWM(backend.write_outputs)
+        self.hardware = {}
+        self.stats = PWMStats()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.stopped = False
+
+    def channel(self, gpio, frequency):
+        """Return an RPi.GPIO.PWM compatible channel for gpio"""
+        with self._lock:
+            pwm = self._hardware_channel(gpio, frequency)
+            if pwm is not None:
+                return pwm
+
+        self.soft.start()
+        return SoftPWMChannel(self, gpio, frequency)
+
+    def _hardware_channel(self, gpio, frequency):
+        if gpio not in HARDWARE_PWM:
+            return None
+
+        channel, function = HARDWARE_PWM[gpio]
+        if channel in self.hardware:
+            return None
+
+        chip = self.backend.pwm_chip()
+        mem = self.backend.gpio_mem()
+        if chip is None or mem is None or mem.function(gpio) != function:
+            return None
+
+        try:
+            pwm = HardwarePWM(self, gpio, frequency, chip, channel)
+        except EnvironmentError:
+            return None
+
+        self.hardware[channel] = pwm
+        return pwm
+
+    def batch(self):
+        """Hold back duty cycle and frequency changes made by this thread
+
+        Use as a context manager. Changes are applied when it exits, all
+        soft PWM channels at once, and only the last change made to each
+        channel is applied."""
+        return PWMBatch(self)
+
+    def _pending(self, channel):
+        pending = getattr(self._local, 'pending', None)
+        if pending is not None:
+            pending.pop(channel, None)
+
+    def start(self, channel, duty_cycle):
+        self._pending(channel)
+        channel.duty_cycle = duty_cycle
+        channel.running = True
+        channel._start()
+        self.stats.duty_applied += 1
+
+    def stop_channel(self, channel):
+        self._pending(channel)
+        if channel.running:
+            channel.running = False
+            # Pins are left alone once the engine has stopped, see stop()
+            if not self.stopped:
+                channel._stop()
+
+    def release_channel(self, channel):
+        self._pending(channel)
+        if channel.running:
+            channel.running = False
+            if not self.stopped:
+                channel._release()
+
+    def change(self, channel, duty_cycle=None, frequency=None):
+        """Change a channel's duty cycle or frequency, unless it already has that value"""
+        stats = self.stats
+        changed = {}
+
+        if duty_cycle is not None:
+            if duty_cycle == channel.duty_cycle:
+                stats.duty_suppressed += 1
+            else:
+                channel.duty_cycle = duty_cycle
+                changed['duty'] = True
+
+        if frequency is not None:
+            if frequency == channel.frequency:
+                stats.frequency_suppressed += 1
+            else:
+                channel.frequency = frequency
+                changed['frequency'] = True
+
+        # A stopped channel picks up its settings when started
+        if not changed or not channel.running:
+            return
+
+        pending = getattr(self._local, 'pending', None)
+
+        if pending is None:
+            self._flush({channel: changed})
+            return
+
+        # Replacing a change that hasn't been applied yet saves a write
+        kinds = pending.setdefault(channel, {})
+        for kind in changed:
+            if kind in kinds:
+                if kind == 'duty':
+                    stats.duty_suppressed += 1
+                else:
+                    stats.frequency_suppressed += 1
+            kinds[kind] = True
+
+    def _flush(self, pending, batch=False):
+        stats = self.stats
+        soft = []
+
+        for channel, kinds in pending.items():
+            if not channel.running:
+                continue
+            if 'duty' in kinds:
+                stats.duty_applied += 1
+            if 'frequency' in kinds:
+                stats.frequency_applied += 1
+
+            if channel.hardware:
+                channel._apply('frequency' in kinds)
+            else:
+                soft.append(channel)
+
+        if soft:
+            self.soft.update(soft)
+
+        if batch and pending:
+            stats.batches += 1
+
+    def get_stats(self):
+        """Return the hardware PWM pins, soft PWM thread activity and applied and suppressed changes"""
+        stats = self.soft.get_stats()
+        stats.update(self.stats.as_dict())
+        stats['hardware'] = sorted(pwm.gpio for pwm in self.hardware.values())
+        return stats
+
+    def reset_stats(self):
+        self.stats.reset()
+
+    def stop(self):
+        """Stop the soft PWM thread and release the hardware channels
+
+        Channels stopped after this, such as by Output.__del__() at
+        interpreter shutdown, no longer touch their pins."""
+        self.stopped = True
+        self.soft.stop()
+        with self._lock:
+            for pwm in self.hardware.values():
+                try:
+                    pwm.close()
+                except EnvironmentError:
+                    pass
+            self.hardware = {}
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_pwm_engine(backend):
+    """Return the shared PWM engine, creating it on first use"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = PWMEngine(backend)
+        return _engine
+
+
+def stop_pwm_engine():
+    """Stop the shared PWM engine"""
+    global _engine
+    with _engine_lock:
+        if _engine is not None:
+            _engine.stop()
+            _engine = None
@@ -0,0 +1,62 @@
+"""Timestamped analog sample history
+
+Requires numpy, which is only imported when a buffer is created."""
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from .ads1015 import PGA_6_144V, code_to_volts
+
+
+class SampleBuffer(object):
+    """Fixed-size ring of (monotonic_ns timestamp, raw ADC code) samples
+
+    Every sample is written twice, half a buffer apart, so the most
+    recent samples are always contiguous and last() can return numpy
+    views without copying. Views are overwritten as new samples arrive,
+    copy them if they need to outlive the next few samples."""
+    def __init__(self, size=1024, programmable_gain=PGA_6_144V):
+        if numpy is None:
+            raise ImportError("Sample buffers require numpy\nInstall with: sudo pip install numpy")
+
+        if size < 1:
+            raise ValueError("Buffer size must be at least 1")
+
+        self.size = size
+        self.programmable_gain = programmable_gain
+        self.timestamps = numpy.zeros(size * 2, dtype=numpy.int64)
+        self.codes = numpy.zeros(size * 2, dtype=numpy.int16)
+        self.count = 0
+        self._head = 0
+
+    def __len__(self):
+        return min(self.count, self.size)
+
+    def append(self, timestamp, code):
+        head = self._head
+        self.timestamps[head] = self.timestamps[head + self.size] = timestamp
+        self.codes[head] = self.codes[head + self.size] = code
+        self._head = (head + 1) % self.size
+        self.count += 1
+
+    def clear(self):
+        self.count = 0
+        self._head = 0
+
+    def last(self, n=None):
+        """Return (timestamps, codes) views of the last n samples, oldest first"""
+        available = len(self)
+        n = available if n is None else min(n, available)
+        end = self._head + self.size
+        return self.timestamps[end - n:end], self.codes[end - n:end]
+
+    def last_memoryview(self, n=None):
+        """Return (timestamps, codes) memoryviews of the last n samples"""
+        timestamps, codes = self.last(n)
+        return memoryview(timestamps), memoryview(codes)
+
+    def volts(self, n=None):
+        """Return the last n samples converted to volts, as a new float array"""
+        return self.last(n)[1] * code_to_volts(1, self.programmable_gain)
@@ -0,0 +1,319 @@
+"""Keyframed sequences for outputs, lights and motors
+
+A Timeline holds keyframes for any number of targets. It is compiled
+once into a single time-ordered list of value changes, and played back
+by the shared animation scheduler, so a long light show or motor
+routine costs no threads of its own and sleeps between changes.
+
+Every change is scheduled against the time playback started, rather
+than the time of the previous change, so timing never drifts however
+long a sequence runs or loops."""
+
+import sys
+from bisect import bisect_right
+
+from .animation import NANOSECONDS, Animation, frame_at, frame_deadline, get_scheduler
+from .pins import ObjectCollection, monotonic_ns
+from .waveform import get_shape
+
+
+FPS = 50
+
+
+def _resolve(target, root):
+    """Look up a target given by name, such as "red" or "light.red", on root"""
+    obj = target
+
+    if isinstance(target, str):
+        obj = root
+        for name in target.split('.'):
+            # A collection answers any name with a function calling it on every member
+            if isinstance(obj, ObjectCollection):
+                found = name in obj._index or name in obj._aliases
+            else:
+                found = hasattr(obj, name)
+            if not found:
+                raise ValueError("Unknown timeline target: {}".format(target))
+            obj = getattr(obj, name)
+
+    if not hasattr(obj, '_timeline_setter'):
+        raise ValueError("Timeline target {} is not an output, light or motor".format(target))
+    return obj
+
+
+class Compiled(object):
+    """A Timeline reduced to the value changes of each track
+
+    events is every change, ordered by frame, as (frame, track, value).
+    changes[track] is the frames and values of that track's changes alone."""
+    def __init__(self, targets, changes, length, fps):
+        self.targets = targets
+        self.changes = changes
+        self.length = length
+        self.fps = fps
+
+        self.events = sorted((frame, track, value)
+                             for track, (frames, values) in enumerate(changes)
+                             for frame, value in zip(frames, values))
+        self.frames = [event[0] for event in self.events]
+
+    def values_at(self, frame):
+        """Return the value of each track at frame, None where a track has yet to start"""
+        values = []
+        for frames, track_values in self.changes:
+            index = bisect_right(frames, frame)
+            values.append(track_values[index - 1] if index else None)
+        return values
+
+
+class Timeline(object):
+    """Keyframes for any number of outputs, lights and motors
+
+    A target is an Output, Light or Motor, or the name of one. Names
+    are looked up when the timeline is played, either on the collection
+    it's played on, such as "red" for explorerhat.light, or from the
+    top of the library, such as "light.red" or "motor.one".
+
+    Values are a brightness from 0 to 100 for outputs and lights,
+    and a speed from -100 to 100 for motors."""
+    def __init__(self, duration=None, fps=FPS):
+        """@param duration Length of the timeline in seconds, defaults to the time of the last keyframe
+        @param fps Frames per second that ramps between keyframes are worked out at"""
+        self.duration = duration
+        self.fps = fps
+        self.player = None
+
+        self._tracks = {}
+        self._order = []
+        self._compiled = None
+
+    def key(self, target, time, value, shape=None):
+        """Add a keyframe
+
+        @param target Output, Light or Motor, or the name of one
+        @param time Seconds from the start of the timeline
+        @param value Brightness or speed to reach at time
+        @param shape None to jump to value at time, or a waveform shape such as 'linear' to ramp from the previous keyframe
+
+        Returns the timeline, so keyframes can be chained."""
+        if time < 0:
+            raise ValueError("Keyframe time must not be negative")
+
+        if shape is not None:
+            get_shape(shape)
+
+        if target not in self._tracks:
+            self._tracks[target] = []
+            self._order.append(target)
+
+        self._tracks[target].append((time, value, shape))
+        self._compiled = None
+        return self
+
+    def compile(self):
+        """Work out every value change, done once and reused until keyframes are added"""
+        if self._compiled is not None:
+            return self._compiled
+
+        fps = self.fps
+        changes = []
+        last_frame = 0
+
+        for target in self._order:
+            frames = []
+            values = []
+            previous = None
+
+            for time, value, shape in sorted(self._tracks[target], key=lambda key: key[0]):
+                end = int(round(time * fps))
+
+                if shape is not None and previous is not None:
+                    function = get_shape(shape)
+                    start, start_value = previous
+                    for frame in range(start + 1, end):
+                        level = start_value + (value - start_value) * function(float(frame - start) / (end - start))
+                        self._change(frames, values, frame, int(round(level)))
+
+                self._change(frames, values, end, value)
+                previous = (end, value)
+                last_frame = max(last_frame, end)
+
+            changes.append((frames, values))
+
+        if self.duration is None:
+            length = last_frame
+        else:
+            length = int(round(self.duration * fps))
+
+            # Looping would cut them off, and playing once would run past the end
+            for target in self._order:
+                for time, value, shape in self._tracks[target]:
+                    if int(round(time * fps)) > length:
+                        raise ValueError("Keyframe for {} at {}s is after the end of the timeline at {}s".format(
+                            target, time, self.duration))
+
+        self._compiled = Compiled(list(self._order), changes, length, fps)
+        return self._compiled
+
+    @staticmethod
+    def _change(frames, values, frame, value):
+        if frames and frames[-1] == frame:
+            # Two keyframes in the same frame, the later wins
+            frames.pop()
+            values.pop()
+        if values and values[-1] == value:
+            return
+        frames.append(frame)
+        values.append(value)
+
+    def play(self, collection=None, loop=False, position=0):
+        """Start playing, stopping any earlier playback of this timeline
+
+        @param collection Collection to look up named targets on, defaults to the whole library
+        @param loop True to repeat the timeline until stopped
+        @param position Seconds into the timeline to start from
+
+        Returns the TimelinePlayer."""
+        if self.player is not None:
+            self.player.stop()
+
+        root = collection if collection is not None else sys.modules[__package__]
+        compiled = self.compile()
+        targets = [_resolve(target, root) for target in compiled.targets]
+
+        self.player = TimelinePlayer(compiled, targets, loop)
+        self.player.seek(position)
+        return self.player
+
+    def stop(self):
+        """Stop playback, leaving each target at its current value"""
+        if self.player is not None:
+            self.player.stop()
+
+    def pause(self):
+        if self.player is not None:
+            self.player.pause()
+
+    def resume(self):
+        if self.player is not None:
+            self.player.resume()
+
+    def seek(self, position):
+        """Jump to position seconds into the timeline"""
+        if self.player is not None:
+            self.player.seek(position)
+
+    @property
+    def position(self):
+        return self.player.position if self.player is not None else 0
+
+    def get_stats(self):
+        """Returns frame timing of the current playback, see Output.get_animation_stats"""
+        return self.player.get_stats() if self.player is not None else None
+
+
+class TimelinePlayer(Animation):
+    """Plays a compiled Timeline on the shared animation scheduler"""
+    def __init__(self, compiled, targets, loop=False):
+        Animation.__init__(self)
+
+        self.compiled = compiled
+        self.fps = compiled.fps
+        self.loop = loop and compiled.length > 0
+        self.setters = [target._timeline_setter() for target in targets]
+
+        self.time_start = monotonic_ns()
+        self._cycle = 0
+        self._index = 0
+        self._paused_at = None
+
+    @property
+    def position(self):
+        """Seconds into the timeline"""
+        if self._paused_at is not None:
+            return self._paused_at
+        elapsed = float(monotonic_ns() - self.time_start) / NANOSECONDS
+        if self.loop:
+            elapsed %= float(self.compiled.length) / self.fps
+        return elapsed
+
+    def seek(self, position):
+        """Jump to position seconds in, applying each target's value at that point"""
+        compiled = self.compiled
+        frame = int(round(position * self.fps))
+        if self.loop:
+            frame %= compiled.length
+
+        with get_scheduler().lock:
+            for setter, value in zip(self.setters, compiled.values_at(frame)):
+                if value is not None:
+                    setter(value)
+
+            self._cycle = 0
+            self._index = bisect_right(compiled.frames, frame)
+            self.time_start = monotonic_ns() - frame_deadline(0, frame, self.fps)
+
+            deadline = self._deadline()
+            if self._paused_at is not None:
+                self._paused_at = float(frame) / self.fps
+            elif deadline is not None:
+                get_scheduler().add(self, deadline)
+            else:
+                Animation.stop(self)
+
+    def pause(self):
+        with get_scheduler().lock:
+            if self._paused_at is None:
+                self._paused_at = self.position
+                Animation.stop(self)
+
+    def resume(self):
+        with get_scheduler().lock:
+            if self._paused_at is not None:
+                position, self._paused_at = self._paused_at, None
+                self.seek(position)
+
+    def stop(self):
+        with get_scheduler().lock:
+            self._paused_at = None
+            Animation.stop(self)
+
+    def _deadline(self):
+        compiled = self.compiled
+        if self._index < len(compiled.events):
+            frame = compiled.events[self._index][0]
+        elif self.loop:
+            frame = compiled.length
+        else:
+            return None
+        return frame_deadline(self.time_start, self._cycle * compiled.length + frame, self.fps)
+
+    def step(self, now):
+        compiled = self.compiled
+        frame = frame_at(self.time_start, now, self.fps)
+
+        # Only the latest due value of each track is written, so a late frame catches up in one go
+        due = {}
+
+        if self.loop:
+            cycle, frame = divmod(frame, compiled.length)
+            if cycle != self._cycle:
+                # Finish the cycle that was playing, then start the current one
+                self._collect(due, compiled.length)
+                self._cycle = cycle
+                self._index = 0
+
+        self._collect(due, frame)
+
+        for track, value in due.items():
+            self.setters[track](value)
+
+        return self._deadline()
+
+    def _collect(self, due, frame):
+        events = self.compiled.events
+        index = self._index
+        while index < len(events) and events[index][0] <= frame:
+            due[events[index][1]] = events[index][2]
+            index += 1
+        self._index = index
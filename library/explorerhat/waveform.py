@@ -0,0 +1,163 @@
+"""Precomputed duty cycle tables for pulses and fades
+
+An animation's brightness is worked out once, as one integer duty
+cycle per frame, so each frame is just a table lookup. Tables are
+shared by every animation with the same shape and timing.
+
+Each table also records the frame at which its value next changes,
+so an animation can sleep straight through a run of identical frames
+rather than waking to write the same duty cycle again."""
+
+import math
+import threading
+from array import array
+from collections import OrderedDict
+
+
+GAMMA = 2.2
+
+# Least recently used tables are dropped beyond this many
+MAX_TABLES = 128
+
+
+def linear(x):
+    return x
+
+
+def sine(x):
+    """Eases in and out"""
+    return (1.0 - math.cos(math.pi * x)) / 2.0
+
+
+def gamma(x):
+    """Perceptually even brightness steps"""
+    return x ** GAMMA
+
+
+SHAPES = {
+    'linear': linear,
+    'sine': sine,
+    'gamma': gamma
+}
+
+
+def register_shape(name, function):
+    """Add a custom shape, function maps 0.0 to 1.0 through the transition onto 0.0 to 1.0 brightness
+
+    Brightness outside 0.0 to 1.0, from a curve that overshoots, is clipped.
+    Replacing a shape drops any tables built with the one it replaces."""
+    with _tables_lock:
+        SHAPES[name] = function
+        for key in [key for key in _tables if key[1] == name]:
+            del _tables[key]
+
+
+def get_shape(shape):
+    if callable(shape):
+        return shape
+    try:
+        return SHAPES[shape]
+    except KeyError:
+        raise ValueError("Unknown waveform shape: {}, expected one of: {}".format(shape, ', '.join(sorted(SHAPES))))
+
+
+def _duty(value):
+    """Round to a whole duty cycle, clipped to 0 to 100"""
+    return int(round(max(0.0, min(100.0, value))))
+
+
+class Waveform(object):
+    """Duty cycle of each frame of an animation
+
+    next_change[n] is the first frame after n with a different duty
+    cycle. For a looping waveform it may run past the end, counting
+    on into the next cycle."""
+    def __init__(self, duties, fps, loop=False):
+        self.duties = array('B', duties)
+        self.fps = fps
+        self.loop = loop
+        self.next_change = self._next_changes()
+
+    def __len__(self):
+        return len(self.duties)
+
+    @property
+    def duration(self):
+        return float(len(self.duties)) / self.fps
+
+    def _next_changes(self):
+        duties = self.duties
+        count = len(duties)
+        span = count * 2 if self.loop else count
+
+        next_change = array('L', [0] * count)
+        change = span
+
+        for index in range(span - 1, -1, -1):
+            if index < count:
+                next_change[index] = change
+            if index > 0 and duties[(index - 1) % count] != duties[index % count]:
+                change = index
+
+        return next_change
+
+
+_tables = OrderedDict()
+_tables_lock = threading.Lock()
+
+
+def _cached(key, build):
+    with _tables_lock:
+        waveform = _tables.pop(key, None)
+
+        if waveform is None:
+            waveform = build()
+            while len(_tables) >= MAX_TABLES:
+                _tables.popitem(last=False)
+
+        _tables[key] = waveform
+        return waveform
+
+
+def fade(start, end, duration, fps, shape='linear'):
+    """Return the Waveform for a fade from start to end duty cycle over duration seconds
+
+    The last frame is always the end duty cycle."""
+    if not (0 <= start <= 100 and 0 <= end <= 100):
+        raise ValueError("Fade start and end must be between 0 and 100")
+
+    function = get_shape(shape)
+
+    def build():
+        frames = int(math.ceil(duration * fps)) if duration > 0 else 0
+        duties = [_duty(start + (end - start) * function(float(frame) / (duration * fps))) for frame in range(frames)]
+        return Waveform(duties + [_duty(end)], fps)
+
+    return _cached(('fade', shape, duration, fps, start, end), build)
+
+
+def pulse(transition_on, time_on, transition_off, time_off, fps, shape='linear'):
+    """Return the looping Waveform for one cycle of a pulse between 0 and 100% duty cycle"""
+    function = get_shape(shape)
+
+    def build():
+        on_end = transition_on + time_on
+        off_end = on_end + transition_off
+        cycle = off_end + time_off
+        duties = []
+
+        for frame in range(max(1, int(round(cycle * fps)))):
+            t = float(frame) / fps
+            if t < transition_on:
+                level = function(t / transition_on)
+            elif t < on_end:
+                level = 1.0
+            elif t < off_end:
+                level = function(1.0 - (t - on_end) / transition_off)
+            else:
+                level = 0.0
+            duties.append(_duty(100.0 * level))
+
+        return Waveform(duties, fps, loop=True)
+
+    return _cached(('pulse', shape, (transition_on, time_on, transition_off, time_off), fps), build)